@@ -9,30 +9,1044 @@
 # interface to standard output. Plain "cat" is not sufficient
 # as each read() syscall returns log data with a 32bit binary
 # header, containing the payload length.
+#
+# All DSP cores are captured at once, each one by its own thread,
+# as reads of the debugfs files block until the core logs data.
+# With more than one core, each output line is tagged with the id
+# of the core that logged it.
+#
+# Records are read into a few preallocated buffers per core, which
+# the main thread hands back after writing their payload, so that
+# bursts of traces don't allocate memory. Output is collected in a
+# buffer and written when it is full or has been pending for
+# FLUSH_INTERVAL, instead of with one syscall per record.
+#
+# With --capture, records are written to segment files in a directory
+# instead, keeping the timing of the logs for long soak tests. Each
+# segment starts with a SEGMENT_HEADER, holding the CLOCK_REALTIME and
+# CLOCK_MONOTONIC times of its creation, followed by the records, each
+# one a RECORD_HEADER with the payload length, the core id and the
+# CLOCK_MONOTONIC time of the read, and the payload. Segments are
+# closed when they reach a size or age limit, and can be compressed
+# by xz or zstd once closed. Readers never wait for the segments to
+# be written, records are dropped and counted if they fall behind.
+#
+# With --decode, the log lines of captured segments are parsed into
+# entries and printed with their wall clock time, optionally limited
+# to one component and a time range. This uses an index stored next
+# to each segment, built on first use, which records per INDEX_BLOCK
+# of the segment its time range and the components logging in it, so
+# that only the blocks of interest are decoded.
+#
+# Other processes can consume the records in their own asyncio event
+# loop with MtraceReader. Importing the module has no side effects,
+# but as the file name isn't a valid module name, it has to be loaded
+# with importlib:
+#
+#   spec = importlib.util.spec_from_file_location(
+#       "mtrace_reader", "/usr/local/bin/mtrace-reader.py")
+#   mtrace_reader = importlib.util.module_from_spec(spec)
+#   spec.loader.exec_module(mtrace_reader)
 
+import argparse
+import asyncio
+import collections
+import contextlib
+import datetime
+import glob
+import json
+import queue
+import re
+import shutil
 import struct
+import subprocess
 import os
+import select
 import sys
+import threading
+import time
 
 READ_BUFFER = 16384
-MTRACE_FILE = "/sys/kernel/debug/sof/mtrace/core0"
+# read buffers grow to hold records longer than READ_BUFFER, up to
+# this size, longer records are considered corrupt and discarded
+MAX_READ_BUFFER = 1 << 24
+MTRACE_DIR = "/sys/kernel/debug/sof/mtrace"
+MTRACE_FILES = MTRACE_DIR + "/core*"
+
+# read buffers per core, a reader waits for the main thread to hand
+# one back when they are all queued for writing
+BUFFERS = 4
+# read buffers per core when capturing, readers don't wait for them
+# but drop records, so they have to cover stalls of segment writes
+CAPTURE_BUFFERS = 64
+
+HEADER = struct.Struct('I')
+
+# capture segment header: magic, CLOCK_REALTIME and CLOCK_MONOTONIC
+# times of the segment creation (ns), and record header: payload
+# length, core id, reserved, CLOCK_MONOTONIC time of the read (ns)
+CAPTURE_MAGIC = b"MTRACE\x00\x01"
+SEGMENT_HEADER = struct.Struct('<8sQQ')
+RECORD_HEADER = struct.Struct('<IHHQ')
+
+# commands compressing closed capture segments in place, and the
+# suffix they add to the file name
+COMPRESSORS = {
+    "xz": (["xz", "-q"], ".xz"),
+    "zstd": (["zstd", "-q", "--rm"], ".zst"),
+}
+DECOMPRESSORS = {
+    ".xz": ["xz", "-dc"],
+    ".zst": ["zstd", "-dcq"],
+}
+
+# SOF log line, as formatted by the Zephyr logging subsystem, e.g.
+# "[00:00:01.234,567] <inf> ipc: rx	: 0x12|0x0", or with the DSP
+# timestamp in cycles when it isn't formatted. colors are stripped
+ENTRY = re.compile(r"\[\s*([^\]]*?)\s*\]\s+<(\w+)>\s+([\w.-]+):\s?(.*)")
+COLORS = re.compile(r"\x1b\[[0-9;]*m")
+
+# bytes of records per index block, and index format version
+INDEX_BLOCK = 262144
+INDEX_VERSION = 1
+
+# size of the output buffer, and the longest time output is kept in
+# it before it's written (seconds)
+OUTPUT_BUFFER = 65536
+FLUSH_INTERVAL = 0.1
+
+# records MtraceReader keeps for its consumer before dropping them
+QUEUE_SIZE = 1024
+
+# events counted per core, rates are reported for the first two
+STATS = ("records", "bytes", "short reads", "truncations", "stalls",
+         "drops")
+
+# bounds of the sleep between reads returning no data, for files
+# that can't be polled (seconds)
+BACKOFF_MIN = 0.001
+BACKOFF_MAX = 0.1
+
+
+def open_poller(fd):
+    # return epoll object waiting for fd to become readable, or None
+    # if fd doesn't support polling. debugfs files without a poll
+    # handler are rejected by epoll with EPERM, while poll() and
+    # select() would report them as always readable
+    poller = select.epoll()
+    try:
+        poller.register(fd, select.EPOLLIN)
+    except OSError:
+        poller.close()
+        return None
+    return poller
+
+
+def core_id(path, default):
+    # core id from the name of the mtrace file, e.g. 1 for "core1"
+    match = re.search(r"core(\d+)$", path)
+    return int(match.group(1)) if match else default
+
+
+def split_records(buf, end, size):
+    # split buf[:end] into the complete records and the incomplete one
+    # after them. return list of (start, end) of the payloads of the
+    # complete records, a copy of the incomplete record, None if it is
+    # longer than MAX_READ_BUFFER and has to be discarded, and the read
+    # buffer size needed for it, grown from size
+    spans = []
+    start = 0
+    while end - start >= HEADER.size:
+        data_len, = HEADER.unpack_from(buf, start)
+        if start + HEADER.size + data_len > end:
+            break
+        start += HEADER.size
+        spans.append((start, start + data_len))
+        start += data_len
+
+    tail = bytes(buf[start:end])
+    if len(tail) >= HEADER.size:
+        data_len, = HEADER.unpack_from(tail)
+        if HEADER.size + data_len > MAX_READ_BUFFER:
+            return spans, None, size
+        while size < HEADER.size + data_len:
+            size *= 2
+    return spans, tail, size
+
+
+def read_core(core, fd, records, stats, buffers=BUFFERS, drop=False):
+    # reader thread of one core, puts (core, timestamp, buffer, spans,
+    # free) tuples to the records queue, where spans are the (start,
+    # end) of the payloads in buffer, timestamp the CLOCK_MONOTONIC
+    # time of the read in ns, and the buffer has to be put back to
+    # free once written. at end-of-file, (core, 0, None, (), None) is
+    # put. if drop is set, the reader doesn't wait for free buffers but
+    # drops the records it can't queue. events are counted in stats, a
+    # Counter with the STATS keys
+    #
+    # a read may return several records and end within one, as from a
+    # pipe, the incomplete record is copied to the start of the next
+    # buffer. buffers grow when a record doesn't fit into them
+    poller = open_poller(fd)
+    backoff = BACKOFF_MIN
+    size = READ_BUFFER
+    free = queue.SimpleQueue()
+    for _ in range(buffers):
+        free.put(bytearray(size))
+    spare = bytearray(size)
+    tail = b""
+
+    try:
+        while True:
+            if poller:
+                poller.poll()
+
+            try:
+                buf = free.get_nowait()
+            except queue.Empty:
+                if drop:
+                    # still read the records, so that the DSP isn't
+                    # held up, but drop them
+                    buf = spare
+                else:
+                    # wait for the main thread to write a record
+                    stats["stalls"] += 1
+                    buf = free.get()
+            if len(buf) < size:
+                grown = bytearray(size)
+                if buf is spare:
+                    spare = grown
+                buf = grown
+
+            # direct unbuffered reads must be used to comply with
+            # debugfs protocol used. each non-zero read will return
+            # a buffer containing a 32bit header and a payload
+            buf[:len(tail)] = tail
+            read_len = os.readv(fd, [memoryview(buf)[len(tail):]])
+            timestamp = time.monotonic_ns()
+            spans, tail, size = split_records(buf, len(tail) + read_len,
+                                              size)
+            if tail is None:
+                stats["truncations"] += 1
+                tail = b""
+
+            # handle end-of-file and reads without payload. without
+            # poll support, back off exponentially while the DSP is
+            # quiet instead of spinning on the read
+            if not any(end > start for start, end in spans):
+                if read_len <= HEADER.size:
+                    stats["short reads"] += 1
+                if buf is not spare:
+                    free.put(buf)
+                if poller and not read_len:
+                    # a pollable file (e.g. a pipe) at end-of-file would
+                    # be reported readable forever
+                    break
+                if not poller:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, BACKOFF_MAX)
+                continue
+            backoff = BACKOFF_MIN
+            if buf is spare:
+                stats["drops"] += len(spans)
+                continue
+
+            stats["records"] += len(spans)
+            stats["bytes"] += sum(end - start for start, end in spans)
+            records.put((core, timestamp, buf, spans, free))
+    finally:
+        records.put((core, 0, None, (), None))
+
+
+def tag_lines(prefix, buf, start, end, partial):
+    # return list of buffers with the complete lines of partial and
+    # buf[start:end], each prefixed with prefix, and the remaining
+    # incomplete line. the lines are views of buf, only the incomplete
+    # line is copied, as buf is reused
+    view = memoryview(buf)
+    buffers = []
+    while (newline := buf.find(b"\n", start, end)) >= 0:
+        buffers.append(prefix)
+        if partial:
+            buffers.append(partial)
+            partial = b""
+        buffers.append(view[start:newline + 1])
+        start = newline + 1
+    return buffers, partial + view[start:end]
+
+
+class Writer:
+    # buffered output to a file descriptor, coalescing small writes
+    # into writes of up to OUTPUT_BUFFER bytes
+
+    def __init__(self, fd, size=OUTPUT_BUFFER):
+        self.fd = fd
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.fill = 0
+        # time by which buffered output has to be written, None if
+        # the buffer is empty
+        self.deadline = None
+
+    def write(self, data):
+        if self.fill + len(data) > len(self.buf):
+            self.flush()
+        if len(data) >= len(self.buf):
+            self._write_all(data)
+            return
+
+        self.view[self.fill:self.fill + len(data)] = data
+        self.fill += len(data)
+        if self.deadline is None:
+            self.deadline = time.monotonic() + FLUSH_INTERVAL
+
+    def flush(self):
+        if self.fill:
+            self._write_all(self.view[:self.fill])
+            self.fill = 0
+        self.deadline = None
+
+    def _write_all(self, data):
+        # write() may write less than requested, e.g. to a pipe or
+        # a socket, so loop until everything is written. EPIPE is
+        # raised as BrokenPipeError
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+
+class Stream:
+    # sink writing the payload of records to a file descriptor. with
+    # more than one core, each line is tagged with the core id
+
+    def __init__(self, fd, cores):
+        self.writer = Writer(fd)
+        self.tag = len(cores) > 1
+        self.prefixes = {core: b"[core%d] " % core for core in cores}
+        self.partial = dict.fromkeys(cores, b"")
+
+    @property
+    def deadline(self):
+        return self.writer.deadline
+
+    def write(self, core, timestamp, buf, start, end):
+        if self.tag:
+            buffers, self.partial[core] = tag_lines(
+                self.prefixes[core], buf, start, end, self.partial[core])
+        else:
+            buffers = [memoryview(buf)[start:end]]
+        for data in buffers:
+            self.writer.write(data)
+
+    def end(self, core):
+        # core at end-of-file, terminate its incomplete line
+        if self.partial[core]:
+            for data in (self.prefixes[core], self.partial[core], b"\n"):
+                self.writer.write(data)
+            self.partial[core] = b""
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.flush()
+
+
+class Capture:
+    # sink writing records with their core id and timestamp to segment
+    # files in a directory. a segment is closed once it holds max_size
+    # bytes or is max_age seconds old, then compressed in the background
+    # if compress names one of COMPRESSORS. only the newest keep closed
+    # segments are kept, unless keep is 0
+
+    def __init__(self, directory, max_size, max_age, keep=0, compress=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.keep = keep
+        self.compress = COMPRESSORS[compress] if compress else None
+        # closed segments, oldest first, and running compressors
+        self.segments = collections.deque()
+        self.jobs = {}
+        self.sequence = 0
+        self._open()
+
+    @property
+    def deadline(self):
+        # the earlier of the flush deadline and the end of the segment's
+        # age, if it holds records. segments without records are kept,
+        # rather than rotating empty ones while the DSP is quiet
+        deadline = self.writer.deadline
+        if self.size > SEGMENT_HEADER.size:
+            rotation = self.opened + self.max_age
+            if deadline is None or rotation < deadline:
+                deadline = rotation
+        return deadline
+
+    def write(self, core, timestamp, buf, start, end):
+        if self.size >= self.max_size or self._expired():
+            self._close()
+            self._open()
+        elif self.size == SEGMENT_HEADER.size:
+            # the age of a segment counts from its first record
+            self.opened = time.monotonic()
+
+        payload = memoryview(buf)[start:end]
+        self.writer.write(RECORD_HEADER.pack(len(payload), core, 0,
+                                             timestamp))
+        self.writer.write(payload)
+        self.size += RECORD_HEADER.size + len(payload)
+
+    def end(self, core):
+        pass
+
+    def flush(self):
+        # called once the deadline passed, rotates an expired segment
+        if self._expired():
+            self._close()
+            self._open()
+        else:
+            self.writer.flush()
+
+    def close(self):
+        # close the current segment and wait for the compressors
+        self._close()
+        for job in self.jobs.values():
+            job.wait()
+        self.jobs.clear()
+
+    def _expired(self):
+        return (self.size > SEGMENT_HEADER.size and
+                time.monotonic() - self.opened >= self.max_age)
+
+    def _open(self):
+        # the sequence number keeps names unique and ordered when
+        # segments are rotated within a second
+        name = "mtrace-%s-%04d.bin" % (time.strftime("%Y%m%d-%H%M%S"),
+                                       self.sequence)
+        self.sequence += 1
+        self.path = os.path.join(self.directory, name)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        self.writer = Writer(fd)
+        self.writer.write(SEGMENT_HEADER.pack(CAPTURE_MAGIC, time.time_ns(),
+                                              time.monotonic_ns()))
+        self.size = SEGMENT_HEADER.size
+        self.opened = time.monotonic()
+
+    def _close(self):
+        self.writer.flush()
+        os.close(self.writer.fd)
+
+        # forget compressors that are done
+        for path, job in list(self.jobs.items()):
+            if job.poll() is not None:
+                del self.jobs[path]
+        if self.compress:
+            command, _ = self.compress
+            self.jobs[self.path] = subprocess.Popen(
+                command + [self.path], stdin=subprocess.DEVNULL)
+
+        self.segments.append(self.path)
+        while self.keep and len(self.segments) > self.keep:
+            self._remove(self.segments.popleft())
+
+    def _remove(self, path):
+        # remove a closed segment, compressed or not
+        job = self.jobs.pop(path, None)
+        if job:
+            job.kill()
+            job.wait()
+        paths = [path, path + ".idx"]
+        if self.compress:
+            paths += [path + self.compress[1], path + self.compress[1] + ".idx"]
+        for name in paths:
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+
+# entry of a decoded log line: CLOCK_MONOTONIC time (ns) of the read
+# of the record completing it, core id, level, component, and DSP
+# timestamp as logged, all None if the line isn't a log entry, and
+# the message
+Entry = collections.namedtuple(
+    "Entry", "time core level component timestamp message")
+
+
+def parse_entry(core, timestamp, line):
+    text = COLORS.sub("", line.decode(errors="replace")).rstrip("\r")
+    match = ENTRY.match(text)
+    if not match:
+        return Entry(timestamp, core, None, None, None, text)
+    dsp_time, level, component, message = match.groups()
+    return Entry(timestamp, core, level, component, dsp_time, message)
+
+
+class Decoder:
+    # splits the payload of captured records into lines, and parses
+    # them into entries. the incomplete last line of each core is
+    # kept until a record of the core completes it
+
+    def __init__(self):
+        self.partial = {}
+        # offset of the record the incomplete line of a core starts in
+        self.started = {}
+
+    def feed(self, offset, core, timestamp, payload):
+        # return entries of the lines completed by the record at offset
+        lines = (self.partial.pop(core, b"") + payload).split(b"\n")
+        rest = lines.pop()
+        if lines or core not in self.started:
+            self.started[core] = offset
+        if rest:
+            self.partial[core] = rest
+        else:
+            del self.started[core]
+        return [parse_entry(core, timestamp, line) for line in lines]
+
+    def start(self, offset):
+        # offset to start decoding at, for all lines completed by the
+        # records from offset on
+        return min(self.started.values(), default=offset)
+
+
+@contextlib.contextmanager
+def open_segment(path):
+    # binary file object reading a capture segment, decompressing it
+    # if it has one of the DECOMPRESSORS suffixes
+    command = DECOMPRESSORS.get(os.path.splitext(path)[1])
+    if not command:
+        with open(path, "rb") as segment:
+            yield segment
+        return
+
+    process = subprocess.Popen(command + [path], stdout=subprocess.PIPE)
+    try:
+        yield process.stdout
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+
+def read_segment_header(segment, path):
+    # return the CLOCK_REALTIME - CLOCK_MONOTONIC offset of a segment
+    header = segment.read(SEGMENT_HEADER.size)
+    if len(header) < SEGMENT_HEADER.size:
+        raise ValueError("%s: truncated mtrace capture" % path)
+    magic, realtime, monotonic = SEGMENT_HEADER.unpack(header)
+    if magic != CAPTURE_MAGIC:
+        raise ValueError("%s: not an mtrace capture" % path)
+    return realtime - monotonic
+
+
+def read_record(segment):
+    # return (core, timestamp, payload) of the next record, or None at
+    # the end of the segment, or of a segment cut off by a crash
+    header = segment.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    length, core, _, timestamp = RECORD_HEADER.unpack(header)
+    payload = segment.read(length)
+    if len(payload) < length:
+        return None
+    return core, timestamp, payload
+
+
+def skip(segment, count):
+    # skip count bytes, reading them if the segment is a pipe
+    if segment.seekable():
+        segment.seek(count, os.SEEK_CUR)
+        return
+    while count > 0:
+        data = segment.read(min(count, OUTPUT_BUFFER))
+        if not data:
+            break
+        count -= len(data)
+
+
+def build_index(path):
+    # index of a segment: its clock offset, the components logging in
+    # it, and per INDEX_BLOCK of records a list of offset, offset to
+    # start decoding at, time of the first and last record, and mask
+    # of the components (bit n set for components[n]) logging in it
+    stat = os.stat(path)
+    components = {}
+    blocks = []
+    decoder = Decoder()
+    with open_segment(path) as segment:
+        clock = read_segment_header(segment, path)
+        offset = SEGMENT_HEADER.size
+        while record := read_record(segment):
+            core, timestamp, payload = record
+            if not blocks or offset - blocks[-1][0] >= INDEX_BLOCK:
+                blocks.append([offset, decoder.start(offset), timestamp,
+                               timestamp, 0])
+            block = blocks[-1]
+            block[3] = timestamp
+            for entry in decoder.feed(offset, core, timestamp, payload):
+                if entry.component:
+                    bit = components.setdefault(entry.component,
+                                                len(components))
+                    block[4] |= 1 << bit
+            offset += RECORD_HEADER.size + len(payload)
+
+    return {
+        "version": INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "clock": clock,
+        "components": list(components),
+        "blocks": blocks,
+    }
+
+
+def load_index(path):
+    # return index of a segment, from the .idx file next to it if it's
+    # up to date, else built and saved, if the directory is writable
+    index_path = path + ".idx"
+    stat = os.stat(path)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if (index["version"] == INDEX_VERSION and
+                index["size"] == stat.st_size and
+                index["mtime"] == stat.st_mtime_ns):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_index(path)
+    try:
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(index_path + ".tmp", index_path)
+    except OSError:
+        pass
+    return index
+
+
+def query(path, component=None, since=None, until=None):
+    # generate entries of a segment, of component if not None, read
+    # within since and until (CLOCK_REALTIME, ns) if not None. only the
+    # index blocks that can hold matching entries are decoded
+    index = load_index(path)
+    clock = index["clock"]
+    since = -1 if since is None else since - clock
+    until = float("inf") if until is None else until - clock
+    if component is None:
+        mask = None
+    elif component in index["components"]:
+        mask = 1 << index["components"].index(component)
+    else:
+        return
+
+    blocks = index["blocks"]
+    ends = [block[0] for block in blocks[1:]] + [float("inf")]
+    selected = [block + [end] for block, end in zip(blocks, ends)
+                if (mask is None or block[4] & mask) and
+                block[2] <= until and block[3] >= since]
+    if not selected:
+        return
+
+    with open_segment(path) as segment:
+        read_segment_header(segment, path)
+        offset = SEGMENT_HEADER.size
+        decoder = None
+        for first, start, _, _, _, end in selected:
+            # keep decoding if the previous block ended at or after
+            # the start of this one, to keep the incomplete lines
+            if decoder is None or start > offset:
+                skip(segment, start - offset)
+                offset = start
+                decoder = Decoder()
+            while offset < end and (record := read_record(segment)):
+                core, timestamp, payload = record
+                for entry in decoder.feed(offset, core, timestamp, payload):
+                    if (offset >= first and
+                            (component is None or
+                             entry.component == component) and
+                            since <= entry.time <= until):
+                        yield entry._replace(time=entry.time + clock)
+                offset += RECORD_HEADER.size + len(payload)
+
+
+def format_entry(entry):
+    # log line of an entry, prefixed with its wall clock time and core
+    seconds, ns = divmod(entry.time, 1000000000)
+    prefix = "%s.%06d [core%d] " % (
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds)),
+        ns // 1000, entry.core)
+    if entry.level is None:
+        return prefix + entry.message + "\n"
+    return prefix + "[%s] <%s> %s: %s\n" % (
+        entry.timestamp, entry.level, entry.component, entry.message)
+
+
+def wall_time(value):
+    # argparse type of --since and --until, seconds since the epoch or
+    # an ISO 8601 date and time, in local time unless it has a zone
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = datetime.datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "invalid time: %r" % value) from None
+    return int(seconds * 1000000000)
+
+
+def decode(paths, component, since, until):
+    # print entries of capture segments, and of the segments in the
+    # directories among paths
+    segments = []
+    for path in paths:
+        if os.path.isdir(path):
+            segments += sorted(
+                name for name in glob.glob(os.path.join(path, "mtrace-*"))
+                if not name.endswith((".idx", ".tmp")))
+        else:
+            segments.append(path)
+
+    writer = Writer(sys.stdout.fileno())
+    for path in segments:
+        for entry in query(path, component, since, until):
+            writer.write(format_entry(entry).encode())
+    writer.flush()
+
+
+def format_stats(stats, previous, interval):
+    # stats line of the counters of all cores, with rates and counts
+    # since previous, the counters interval seconds before
+    parts = []
+    for core, counters in sorted(stats.items()):
+        delta = counters - previous.get(core, collections.Counter())
+        parts.append("core%d %.0f records/s %.0f bytes/s %s" % (
+            core, delta["records"] / interval, delta["bytes"] / interval,
+            " ".join("%d %s" % (delta[key], key) for key in STATS[2:])))
+    return "; ".join(parts)
+
+
+def report_stats(stats, interval):
+    # stats thread, prints a stats line to stderr every interval seconds
+    previous = {}
+    while True:
+        time.sleep(interval)
+        current = {core: counters.copy() for core, counters in stats.items()}
+        print(format_stats(current, previous, interval), file=sys.stderr,
+              flush=True)
+        previous = current
+
+
+# record of MtraceReader: core id, CLOCK_MONOTONIC time (ns) of the
+# read, and payload
+Record = collections.namedtuple("Record", "core time payload")
+
+
+class MtraceReader:
+    # asyncio async iterator of the records of the mtrace files of
+    # cores, all cores if None, or of files instead:
+    #
+    #   async with MtraceReader(cores=[0, 1]) as reader:
+    #       async for record in reader:
+    #           ...
+    #
+    # files that can be polled are read by the event loop, debugfs
+    # files by a thread each. if maxsize records wait to be consumed,
+    # further ones are dropped and counted in drops[core]. iteration
+    # ends once all files are at end-of-file, which debugfs files
+    # never are, or when the reader is closed. a read error of a
+    # thread is raised by the iteration, which ends after it
+
+    def __init__(self, cores=None, files=None, maxsize=QUEUE_SIZE):
+        if files is None:
+            if cores is None:
+                files = glob.glob(MTRACE_FILES)
+            else:
+                files = [os.path.join(MTRACE_DIR, "core%d" % core)
+                         for core in cores]
+        self.files = files
+        self.cores = [core_id(path, i) for i, path in enumerate(files)]
+        self.maxsize = maxsize
+        self.drops = dict.fromkeys(self.cores, 0)
+        # incomplete record and read size of each core
+        self.tails = dict.fromkeys(self.cores, b"")
+        self.read_sizes = dict.fromkeys(self.cores, READ_BUFFER)
+        self.loop = None
+        self.queue = None
+        self.pollable = []
+        self.running = 0
+        self.closed = False
+
+    def __aiter__(self):
+        if self.loop is None:
+            self._start()
+        return self
+
+    async def __anext__(self):
+        record = await self.queue.get()
+        if record is None:
+            # keep the end mark for further calls
+            self.queue.put_nowait(None)
+            raise StopAsyncIteration
+        if isinstance(record, OSError):
+            # read error of a reader thread, see _fail()
+            raise record
+        return record
+
+    async def __aenter__(self):
+        if self.loop is None:
+            self._start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # stop reading, threads stop after their pending read
+        if self.closed:
+            return
+        self.closed = True
+        if self.loop is None:
+            # never started, iteration ends right away
+            return
+        for fd in self.pollable:
+            self.loop.remove_reader(fd)
+            os.close(fd)
+        self.pollable.clear()
+        self.queue.put_nowait(None)
+
+    def _start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        if self.closed:
+            self.queue.put_nowait(None)
+            return
+        # open all files up front, so that errors are raised right away
+        fds = [os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+               for path in self.files]
+        self.running = len(fds)
+        if not fds:
+            self.queue.put_nowait(None)
+        for core, fd in zip(self.cores, fds):
+            try:
+                self.loop.add_reader(fd, self._read, core, fd)
+            except OSError:
+                # rejected by epoll, see open_poller()
+                os.set_blocking(fd, True)
+                threading.Thread(target=self._read_thread, args=(core, fd),
+                                 daemon=True).start()
+            else:
+                self.pollable.append(fd)
+
+    def _read(self, core, fd):
+        # event loop callback of a readable file
+        try:
+            data = os.read(fd, self.read_sizes[core])
+        except BlockingIOError:
+            return
+        if data:
+            self._put(core, time.monotonic_ns(), data)
+            return
+
+        self.loop.remove_reader(fd)
+        os.close(fd)
+        self.pollable.remove(fd)
+        self._end()
+
+    def _read_thread(self, core, fd):
+        # reader thread of a file that can't be polled, backing off
+        # while the DSP is quiet as read_core() does
+        backoff = BACKOFF_MIN
+        try:
+            while not self.closed:
+                data = os.read(fd, self.read_sizes[core])
+                timestamp = time.monotonic_ns()
+                # every read goes to the framing, even a few bytes may
+                # complete a record split across reads
+                if data:
+                    self.loop.call_soon_threadsafe(self._put, core,
+                                                   timestamp, data)
+                if len(data) <= HEADER.size:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, BACKOFF_MAX)
+                else:
+                    backoff = BACKOFF_MIN
+        except OSError as exc:
+            try:
+                self.loop.call_soon_threadsafe(self._fail, exc)
+            except RuntimeError:
+                pass
+        except RuntimeError:
+            # event loop closed
+            pass
+        finally:
+            os.close(fd)
+
+    def _put(self, core, timestamp, data):
+        if self.closed:
+            return
+        data = self.tails[core] + data
+        spans, tail, self.read_sizes[core] = split_records(
+            data, len(data), self.read_sizes[core])
+        self.tails[core] = tail or b""
+        for start, end in spans:
+            if start == end:
+                continue
+            if self.queue.qsize() >= self.maxsize:
+                self.drops[core] += 1
+                continue
+            self.queue.put_nowait(Record(core, timestamp, data[start:end]))
+
+    def _fail(self, exc):
+        # a reader thread failed, raise its error to the consumer and
+        # end the iteration after it
+        if self.closed:
+            return
+        self.queue.put_nowait(exc)
+        self.close()
+
+    def _end(self):
+        # a pollable file reached end-of-file
+        self.running -= 1
+        if not self.running:
+            self.queue.put_nowait(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stream SOF mtrace logs of all DSP cores to stdout")
+    parser.add_argument(
+        "files", nargs="*",
+        help="mtrace files to read (default: %s)" % MTRACE_FILES)
+    parser.add_argument(
+        "-c", "--capture", metavar="DIR",
+        help="write records with core id and timestamp to segment files "
+             "in DIR instead of streaming the payload to stdout")
+    parser.add_argument(
+        "--segment-size", metavar="MIB", type=int, default=64,
+        help="close capture segments at this size (default: %(default)s)")
+    parser.add_argument(
+        "--segment-time", metavar="SECONDS", type=int, default=3600,
+        help="close capture segments at this age (default: %(default)s)")
+    parser.add_argument(
+        "--keep", metavar="N", type=int, default=0,
+        help="remove all but the newest N closed capture segments")
+    parser.add_argument(
+        "--compress", choices=sorted(COMPRESSORS),
+        help="compress closed capture segments")
+    parser.add_argument(
+        "-d", "--decode", action="store_true",
+        help="print the log entries of captured segments, or of the "
+             "segments in directories, given as files")
+    parser.add_argument(
+        "--component",
+        help="print only the entries of this component when decoding")
+    parser.add_argument(
+        "--since", metavar="TIME", type=wall_time,
+        help="print only the entries read at or after TIME when "
+             "decoding, in seconds since the epoch or ISO 8601 format")
+    parser.add_argument(
+        "--until", metavar="TIME", type=wall_time,
+        help="print only the entries read at or before TIME when decoding")
+    parser.add_argument(
+        "--stats", metavar="SECONDS", type=float,
+        help="print record and byte rates, and counts of short reads, "
+             "discarded oversized records, reads waiting for output to "
+             "be written and dropped records to stderr every SECONDS, and "
+             "totals on exit")
+    args = parser.parse_args()
+
+    if args.decode:
+        if not args.files:
+            parser.error("--decode needs the captured segments to read")
+        try:
+            decode(args.files, args.component, args.since, args.until)
+        except BrokenPipeError:
+            pass
+        except ValueError as error:
+            sys.exit(error)
+        return
+
+    paths = args.files or glob.glob(MTRACE_FILES)
+    if not paths:
+        sys.exit("no mtrace files found, is the SOF driver loaded?")
+    if args.compress and not shutil.which(COMPRESSORS[args.compress][0][0]):
+        sys.exit("%s not found, can't compress segments" % args.compress)
+
+    cores = [core_id(path, i) for i, path in enumerate(paths)]
+    # open all files up front, so that errors are reported right away
+    fds = [os.open(path, os.O_RDONLY) for path in paths]
+
+    if args.capture:
+        os.makedirs(args.capture, exist_ok=True)
+        sink = Capture(args.capture, args.segment_size << 20,
+                       args.segment_time, args.keep, args.compress)
+        buffers, drop = CAPTURE_BUFFERS, True
+    else:
+        sink = Stream(sys.stdout.fileno(), cores)
+        buffers, drop = BUFFERS, False
+
+    records = queue.SimpleQueue()
+    # all keys are set up front, so that the stats thread can copy the
+    # counters while they are updated
+    stats = {core: collections.Counter(dict.fromkeys(STATS, 0))
+             for core in cores}
+    for core, fd in zip(cores, fds):
+        threading.Thread(target=read_core,
+                         args=(core, fd, records, stats[core], buffers, drop),
+                         daemon=True).start()
+    if args.stats:
+        threading.Thread(target=report_stats, args=(stats, args.stats),
+                         daemon=True).start()
+    start = time.monotonic()
+
+    try:
+        try:
+            write_records(records, len(cores), sink)
+        finally:
+            sink.close()
+    except BrokenPipeError:
+        # whatever reads the output went away, e.g. "| head"
+        pass
+    except KeyboardInterrupt:
+        pass
+
+    if args.stats:
+        print("total: " + format_stats(stats, {}, time.monotonic() - start),
+              file=sys.stderr)
+    elif any(counters["drops"] for counters in stats.values()):
+        counts = ("core%d %d" % (core, counters["drops"])
+                  for core, counters in sorted(stats.items()))
+        print("dropped records: " + ", ".join(counts), file=sys.stderr)
+
 
-fd = os.open(MTRACE_FILE, os.O_RDONLY)
-while fd >= 0:
-    # direct unbuffered os.read() must be used to comply with
-    # debugfs protocol used. each non-zero read will return
-    # a buffer containing a 32bit header and a payload
-    read_bytes = os.read(fd, READ_BUFFER)
+def write_records(records, running, sink):
+    # write records to sink until all running readers are at end-of-file
+    while running:
+        try:
+            if sink.deadline is None:
+                core, timestamp, buf, spans, free = records.get()
+            else:
+                core, timestamp, buf, spans, free = records.get(
+                    timeout=max(sink.deadline - time.monotonic(), 0))
+        except queue.Empty:
+            sink.flush()
+            continue
 
-    # handle end-of-file
-    if len(read_bytes) == 0:
-        continue
+        if buf is None:
+            running -= 1
+            sink.end(core)
+            continue
 
-    if len(read_bytes) <= 4:
-        continue
+        # the payload is copied to the output buffer, so the read
+        # buffer can be handed back right away
+        for start, end in spans:
+            sink.write(core, timestamp, buf, start, end)
+        free.put(buf)
 
-    header = struct.unpack('I', read_bytes[0:4])
-    data_len = header[0]
-    data = read_bytes[4:4+data_len]
 
-    os.write(sys.stdout.fileno(), data)
+if __name__ == "__main__":
+    main()
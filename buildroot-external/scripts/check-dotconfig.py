@@ -2,49 +2,195 @@
 
 import argparse
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
 import re
+import sys
+import time
 
-from kconfiglib import Kconfig
+from kconfiglib import (
+    AND,
+    BOOL,
+    HEX,
+    INT,
+    NOT,
+    OR,
+    STR_TO_TRI,
+    STRING,
+    TRI_TO_STR,
+    TRISTATE,
+    TYPE_TO_STR,
+    Choice,
+    Kconfig,
+    Symbol,
+    expr_str,
+    expr_value,
+    split_expr,
+    unescape,
+)
 
 
-# Can be either "CONFIG_OPTION=(y|m|n)" or "# CONFIG_OPTION is not set"
+# Can be either "CONFIG_OPTION=<value>" or "# CONFIG_OPTION is not set", where
+# value is one of y/m/n, an int or hex number, or a quoted string. Values are
+# kept as written in the fragment.
 regex = re.compile(
-    r"^(CONFIG_(?P<option_set>[A-Z0-9_]+)=(?P<value>[mny])"
+    r"^(CONFIG_(?P<option_set>[A-Z0-9_]+)="
+    r'(?P<value>[mny]|0[xX][0-9a-fA-F]+|-?[0-9]+|"(?:[^"\\\n]|\\.)*")'
     r"|# CONFIG_(?P<option_unset>[A-Z0-9_]+) is not set)$"
 )
 
+# same as regex, but for scanning whole fragments at once
+fragment_regex = re.compile(regex.pattern, re.MULTILINE)
+
 # use namedtuple as a lightweight representation of fragment-defined options
 OptionValue = namedtuple("OptionValue", ["option", "value", "file", "line"])
 
+# fragment option that is missing, renamed or retyped in a Kconfig tree (see
+# --compat), detail is the new name or the type change
+Incompatibility = namedtuple("Incompatibility", ["tree", "kind", "spec", "detail"])
 
-def parse_fragment(
+# finding of the fragment analysis (see --analyze), other is the earlier
+# definition of the option a conflict or duplicate refers to
+Finding = namedtuple("Finding", ["kind", "spec", "other"], defaults=[None])
+
+# option that doesn't have the requested value, actual is None if not found,
+# reasons explain why the requested value didn't take effect (see --explain)
+Mismatch = namedtuple("Mismatch", ["spec", "actual", "reasons"], defaults=[()])
+
+# parsed fragments, indexed by (path, strip prefix), with the (mtime, size) they
+# were parsed at, so that only the latest version of a fragment is kept
+_fragment_cache: dict[tuple, tuple[tuple, dict[str, OptionValue]]] = {}
+
+# all definitions of scanned fragments, cached like _fragment_cache
+_scan_cache: dict[tuple, tuple[tuple, tuple[OptionValue, ...]]] = {}
+
+# Kconfig tree shared with the worker processes of a multi-target check
+_shared_kconfig = None
+
+# bumped whenever the layout of the --state file changes
+STATE_VERSION = 3
+
+# base of numbers requested for int and hex symbols
+_NUMBER_BASES = {INT: 10, HEX: 16}
+
+# how far dependency and select chains are followed by --suggest-fix
+_MAX_FIX_DEPTH = 16
+
+# kernel fragments of the defconfigs, analyzed by default
+defconfig_regex = re.compile(
+    r'^BR2_LINUX_KERNEL_CONFIG_FRAGMENT_FILES="(?P<fragments>[^"]*)"$', re.MULTILINE
+)
+
+# SARIF rules of mismatches and analysis findings
+_SARIF_RULES = {
+    "option-mismatch": "Option doesn't have the requested value",
+    "option-not-found": "Option not found in Kconfig tree",
+    "conflict": "Option requested with different values in several fragments",
+    "duplicate": "Option requested with the same value in several fragments",
+    "default": "Option requested with its default value",
+    "renamed": "Option not found in Kconfig tree, but renamed",
+    "retyped": "Option has a different type than in the other Kconfig trees",
+}
+
+
+def _strip_prefix(path: str, strip_path_prefix: str = None) -> str:
+    """
+    Strip path prefix used in the output, if any.
+    """
+    if strip_path_prefix and path.startswith(strip_path_prefix):
+        return path[len(strip_path_prefix) :]
+    return path
+
+
+def _fragment_stamp(filename: str) -> tuple[int, int]:
+    """
+    Return modification time and size of fragment, changing with its contents.
+    """
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
+
+
+def scan_fragment(
     filename: str, strip_path_prefix: str = None
-) -> dict[str, OptionValue]:
+) -> tuple[OptionValue, ...]:
     """
-    Parse Buildroot Kconfig fragment and return dict of OptionValue objects.
+    Scan Buildroot Kconfig fragment and return all its option definitions in
+    the order of the file, including repeated definitions of an option.
+
+    The whole file is scanned with a single finditer() call. Results are
+    cached by path, modification time and size, replacing those of an earlier
+    version of the file.
     """
-    options: dict[str, OptionValue] = {}
+    key = (filename, strip_path_prefix)
+    stamp = _fragment_stamp(filename)
+    if (cached := _scan_cache.get(key)) is not None and cached[0] == stamp:
+        return cached[1]
 
     with open(filename) as f:
-        if strip_path_prefix and filename.startswith(strip_path_prefix):
-            filename = filename[len(strip_path_prefix) :]
-
-        for line_number, line in enumerate(f, 1):
-            if matches := re.match(regex, line):
-                if matches["option_unset"]:
-                    value = OptionValue(
-                        matches["option_unset"], None, filename, line_number
-                    )
-                    options.update({matches.group("option_unset"): value})
-                else:
-                    value = OptionValue(
-                        matches["option_set"], matches["value"], filename, line_number
-                    )
-                    options.update({matches.group("option_set"): value})
+        content = f.read()
+
+    filename = _strip_prefix(filename, strip_path_prefix)
+    specs = []
+
+    # line numbers are counted incrementally between matches
+    line_number = 1
+    pos = 0
+    for matches in fragment_regex.finditer(content):
+        start = matches.start()
+        line_number += content.count("\n", pos, start)
+        pos = start
+
+        if option := matches["option_unset"]:
+            specs.append(OptionValue(option, None, filename, line_number))
+        else:
+            option = matches["option_set"]
+            specs.append(
+                OptionValue(option, matches["value"], filename, line_number)
+            )
+
+    specs = tuple(specs)
+    _scan_cache[key] = (stamp, specs)
+    return specs
+
+
+def parse_fragment(
+    filename: str, strip_path_prefix: str = None
+) -> dict[str, OptionValue]:
+    """
+    Parse Buildroot Kconfig fragment and return dict of OptionValue objects,
+    with the last definition of each option.
+
+    Results are cached by path, modification time and size, so parsing an
+    unchanged fragment again is free. The returned dict must not be modified.
+    """
+    key = (filename, strip_path_prefix)
+    stamp = _fragment_stamp(filename)
+    if (cached := _fragment_cache.get(key)) is not None and cached[0] == stamp:
+        return cached[1]
 
+    options = {spec.option: spec for spec in scan_fragment(filename, strip_path_prefix)}
+    _fragment_cache[key] = (stamp, options)
     return options
 
 
+def merge_fragments(
+    filenames: list[str], strip_path_prefix: str = None
+) -> dict[str, OptionValue]:
+    """
+    Parse fragments and merge their options, later fragments override options
+    of the earlier ones.
+    """
+    expected_options: dict[str, OptionValue] = {}
+    for f in filenames:
+        expected_options.update(parse_fragment(f, strip_path_prefix))
+    return expected_options
+
+
 def _format_message(
     message: str, file: str, line: int, github_format: bool = False
 ) -> str:
@@ -56,6 +202,566 @@ def _format_message(
     return f"{message} (defined in {file}:{line})"
 
 
+def find_mismatches(
+    expected_options: dict[str, OptionValue], kconfig: Kconfig
+) -> list[Mismatch]:
+    """
+    Return list of expected options that don't match the actual Kconfig values.
+    """
+    mismatches: list[Mismatch] = []
+    modules = kconfig.modules.tri_value != 0
+
+    for option, spec in expected_options.items():
+        if (sym := kconfig.syms.get(option)) is None:
+            mismatches.append(Mismatch(spec, None))
+        elif not _matches(
+            spec.value, val := sym.str_value, sym.orig_type, modules
+        ):
+            mismatches.append(Mismatch(spec, val))
+
+    return mismatches
+
+
+def _matches(
+    requested: str, actual: str, sym_type: int = None, modules: bool = True
+) -> bool:
+    """
+    Return True if actual value (None if not found) satisfies requested value
+    (None for "is not set") of a symbol of type sym_type.
+
+    Numbers are compared by value, so e.g. 0x10 matches 0x0010, and strings
+    are unescaped first. Without modules, m requested for a tristate symbol is
+    satisfied by y, which is what the kernel build turns m into.
+    """
+    if actual is None:
+        return False
+    if requested is None:
+        return actual in ("n", "")
+    if actual == requested:
+        return True
+
+    if base := _NUMBER_BASES.get(sym_type):
+        try:
+            return int(requested, base) == int(actual, base)
+        except ValueError:
+            return False
+    if sym_type is STRING:
+        return requested[0] == '"' and unescape(requested[1:-1]) == actual
+    return (
+        requested == "m" and actual == "y" and sym_type is TRISTATE and not modules
+    )
+
+
+def _choice_str(choice: Choice) -> str:
+    """
+    Return name of choice for messages, its prompt if it has no name.
+    """
+    if choice.name:
+        return choice.name
+    prompts = [node.prompt[0] for node in choice.nodes if node.prompt]
+    return f'choice "{prompts[0]}"' if prompts else "choice"
+
+
+def _unmet_deps(sym: Symbol, target: int, memo: dict) -> list[str]:
+    """
+    Return the minimal set of unmet dependencies of sym (or of a choice) for
+    the tristate value target, each followed down the chain.
+    """
+    name = sym.name if isinstance(sym, Symbol) else _choice_str(sym)
+    reasons: list[str] = []
+    for dep in split_expr(sym.direct_dep, AND):
+        if (val := expr_value(dep)) >= target:
+            continue
+        if isinstance(dep, Choice):
+            # choice symbols depend on their choice
+            reasons.append(
+                f"{name} is in {_choice_str(dep)}, which is {TRI_TO_STR[val]}"
+            )
+            reasons.extend(_unmet_deps(dep, target, memo))
+            continue
+        reasons.append(f"{name} depends on {expr_str(dep)} (={TRI_TO_STR[val]})")
+        if isinstance(dep, Symbol):
+            # a bool dependency meets an m target at y
+            dep_target = 2 if dep.orig_type is BOOL else target
+            reasons.extend(_why_not(dep, dep_target, memo))
+    return reasons
+
+
+def _why_not(sym: Symbol, target: int, memo: dict) -> list[str]:
+    """
+    Return reasons why sym doesn't have the tristate value target, following
+    unmet dependencies and blocking selects down the chain.
+
+    Only the already evaluated values of the loaded config are used. Results
+    are memoized in memo, which is shared between all mismatches of a config,
+    so common dependencies are only walked once.
+    """
+    key = (sym, target)
+    if key in memo:
+        return memo[key]
+    # placeholder that ends the walk on dependency loops
+    memo[key] = []
+
+    reasons: list[str] = []
+    actual = sym.tri_value
+
+    if not sym.nodes:
+        reasons.append(f"{sym.name} is not defined in any Kconfig file")
+
+    elif target == 1 and sym.type is BOOL:
+        if sym.orig_type is BOOL:
+            reasons.append(f"{sym.name} is bool and can't be m")
+        else:
+            reasons.append(f"{sym.name} can't be m, as modules are disabled")
+
+    elif target > actual:
+        if expr_value(sym.direct_dep) < target:
+            reasons.extend(_unmet_deps(sym, target, memo))
+        elif sym.visibility < target:
+            if not any(node.prompt for node in sym.nodes):
+                reasons.append(
+                    f"{sym.name} has no prompt and can only be set by select "
+                    "or default"
+                )
+            elif sym.choice:
+                reasons.append(
+                    f"{sym.name} is not visible in the current mode of its choice"
+                )
+            else:
+                reasons.append(f"{sym.name} is not visible")
+        elif sym.choice and target == 2 and sym.choice.selection:
+            reasons.append(
+                f"{sym.name} is in a choice where {sym.choice.selection.name} "
+                "is selected"
+            )
+        else:
+            reasons.append(_user_value_reason(sym, target))
+
+    else:
+        if expr_value(sym.rev_dep) > target:
+            # minimal set of blocking selects, each followed up the chain
+            for select in split_expr(sym.rev_dep, OR):
+                if expr_value(select) > target:
+                    selector = split_expr(select, AND)[0]
+                    reasons.append(
+                        f"{sym.name} is selected by {selector.name} "
+                        f"(={selector.str_value})"
+                    )
+                    if isinstance(selector, Symbol):
+                        reasons.extend(_why_not(selector, target, memo))
+        elif sym.choice and sym.choice.selection is sym:
+            reasons.append(
+                f"{sym.name} is the selection of its choice, another choice "
+                "symbol must be set to y instead"
+            )
+        elif target not in sym.assignable:
+            if expr_value(sym.weak_rev_dep) > target:
+                reasons.append(
+                    f"{sym.name} is implied by {expr_str(sym.weak_rev_dep)} and "
+                    "not visible"
+                )
+            else:
+                reasons.append(
+                    f"{sym.name} is not visible, its value comes from defaults"
+                )
+        else:
+            reasons.append(_user_value_reason(sym, target))
+
+    memo[key] = reasons
+    return reasons
+
+
+def _user_value_reason(sym: Symbol, target: int) -> str:
+    """
+    Describe why an assignable value didn't take effect.
+    """
+    if sym.user_value is None:
+        return (
+            f"{sym.name}={TRI_TO_STR[target]} is assignable, but "
+            f"{sym.name} is not set in the actual config"
+        )
+    return (
+        f"{sym.name}={TRI_TO_STR[target]} is assignable, but the actual config "
+        f"sets {sym.name}={TRI_TO_STR[sym.user_value]}"
+    )
+
+
+def explain_mismatches(
+    mismatches: list[Mismatch], kconfig: Kconfig
+) -> list[Mismatch]:
+    """
+    Return mismatches with reasons why the requested values didn't take
+    effect, computed from the values of the currently loaded config.
+    """
+    memo: dict = {}
+    explained: list[Mismatch] = []
+
+    for mismatch in mismatches:
+        spec = mismatch.spec
+        sym = kconfig.syms.get(spec.option)
+        if sym is None or spec.value not in STR_TO_TRI and spec.value is not None:
+            explained.append(mismatch)
+            continue
+
+        target = STR_TO_TRI[spec.value] if spec.value else 0
+        # the chains of different options overlap, drop repeated reasons
+        reasons = tuple(dict.fromkeys(_why_not(sym, target, memo)))
+        explained.append(mismatch._replace(reasons=reasons))
+
+    return explained
+
+
+def _merge_fix(fix: dict[Symbol, int], other: dict[Symbol, int]) -> bool:
+    """
+    Merge assignments of other into fix, return False if they conflict.
+    """
+    for sym, val in other.items():
+        if fix.setdefault(sym, val) != val:
+            return False
+    return True
+
+
+def _fix(sym: Symbol, target: int, memo: dict, depth: int = 0) -> dict:
+    """
+    Return assignments (Symbol -> tristate value) that give sym the value
+    target, enabling unmet dependencies and lowering blocking selectors, or
+    None if there's no such fix within _MAX_FIX_DEPTH levels.
+
+    Results are memoized in memo, which is shared between all mismatches of a
+    config, so assignments of common dependencies are only computed once.
+    """
+    key = (sym, target)
+    if key in memo:
+        return memo[key]
+    if depth > _MAX_FIX_DEPTH:
+        return None
+    # placeholder that ends the search on dependency loops
+    memo[key] = None
+
+    fix = _calc_fix(sym, target, memo, depth)
+    memo[key] = fix
+    return fix
+
+
+def _calc_fix(sym: Symbol, target: int, memo: dict, depth: int) -> dict:
+    """
+    Worker for _fix(), computes the fix without memoization.
+    """
+    if sym.tri_value == target:
+        return {}
+    if not sym.nodes or sym.orig_type not in (BOOL, TRISTATE):
+        return None
+    if target == 1 and sym.orig_type is BOOL:
+        return None
+
+    fix: dict[Symbol, int] = {}
+
+    if target == 1 and sym.type is BOOL:
+        # modules are disabled
+        modules_fix = _fix(sym.kconfig.modules, 2, memo, depth + 1)
+        if modules_fix is None or not _merge_fix(fix, modules_fix):
+            return None
+
+    if target > sym.tri_value:
+        deps_fix = _fix_deps(sym, target, memo, depth)
+        if deps_fix is None or not _merge_fix(fix, deps_fix):
+            return None
+
+        if not any(node.prompt for node in sym.nodes):
+            # can only be set by select or default
+            return None
+
+    else:
+        for select in split_expr(sym.rev_dep, OR):
+            if expr_value(select) <= target:
+                continue
+            selector = split_expr(select, AND)[0]
+            if not isinstance(selector, Symbol):
+                return None
+            selector_fix = _fix(selector, target, memo, depth + 1)
+            if selector_fix is None or not _merge_fix(fix, selector_fix):
+                return None
+
+        if sym.choice and sym.choice.selection is sym:
+            # another choice symbol has to be selected, which one is up to
+            # the user
+            return None
+        if not any(node.prompt for node in sym.nodes):
+            return None
+
+    if not _merge_fix(fix, {sym: target}):
+        return None
+    return fix
+
+
+def _fix_deps(sym: Symbol, target: int, memo: dict, depth: int) -> dict:
+    """
+    Return assignments that meet the dependencies of sym (or of a choice) for
+    the tristate value target, or None if there are none.
+    """
+    fix: dict[Symbol, int] = {}
+    for dep in split_expr(sym.direct_dep, AND):
+        if expr_value(dep) >= target:
+            continue
+        if isinstance(dep, Choice):
+            # a choice symbol depends on its choice, whose mode follows
+            # from its own dependencies and the symbol being set to y
+            parent_fix = _fix_deps(dep, target, memo, depth + 1)
+        elif isinstance(dep, Symbol):
+            parent_fix = _fix(
+                dep, 2 if dep.orig_type is BOOL else target, memo, depth + 1
+            )
+        elif dep.__class__ is tuple and dep[0] is NOT and isinstance(dep[1], Symbol):
+            parent_fix = _fix(dep[1], 0, memo, depth + 1)
+        else:
+            # comparisons and nested expressions aren't followed
+            return None
+        if parent_fix is None or not _merge_fix(fix, parent_fix):
+            return None
+    return fix
+
+
+def _assign(sym: Symbol, value) -> None:
+    """
+    Set the user value of sym, and the mode of its choice as load_config()
+    infers it from an assignment to a choice symbol.
+    """
+    if sym.choice and STR_TO_TRI.get(value, value) in (1, 2):
+        sym.choice.set_value(value)
+    sym.set_value(value)
+
+
+def suggest_fix(
+    mismatches: list[Mismatch],
+    expected_options: dict[str, OptionValue],
+    kconfig: Kconfig,
+) -> tuple[dict[str, str], list[Mismatch]]:
+    """
+    Return the assignments (option -> value) to append to the fragments so that
+    the requested values of mismatches take effect, and the mismatches no fix
+    was found for.
+
+    The fix is computed from the values of the currently loaded config and
+    verified by applying it along with all expected options, which changes
+    the user values of the loaded config.
+    """
+    memo: dict = {}
+    fix: dict[Symbol, int] = {}
+    fixed: list[Mismatch] = []
+    unfixed: list[Mismatch] = []
+
+    for mismatch in mismatches:
+        spec = mismatch.spec
+        sym = kconfig.syms.get(spec.option)
+        if sym is None or spec.value not in STR_TO_TRI and spec.value is not None:
+            unfixed.append(mismatch)
+            continue
+
+        target = STR_TO_TRI[spec.value] if spec.value else 0
+        trial = dict(fix)
+        if (sym_fix := _fix(sym, target, memo)) is not None and _merge_fix(
+            trial, sym_fix
+        ):
+            fix = trial
+            fixed.append(mismatch)
+        else:
+            unfixed.append(mismatch)
+
+    # verify the fix, the other values are taken over from the actual config
+    for spec in expected_options.values():
+        sym = kconfig.syms.get(spec.option)
+        if sym is not None and (spec.value in STR_TO_TRI or spec.value is None):
+            _assign(sym, spec.value or "n")
+    for sym, val in fix.items():
+        _assign(sym, val)
+    still = {
+        mismatch.spec.option
+        for mismatch in find_mismatches(
+            {mismatch.spec.option: mismatch.spec for mismatch in fixed}, kconfig
+        )
+    }
+    unfixed.extend(mismatch for mismatch in fixed if mismatch.spec.option in still)
+
+    delta: dict[str, str] = {}
+    for sym, val in fix.items():
+        spec = expected_options.get(sym.name)
+        if spec and STR_TO_TRI.get(spec.value or "n") == val:
+            # already requested by the fragments
+            continue
+        delta[sym.name] = TRI_TO_STR[val]
+    return delta, unfixed
+
+
+def print_fix(
+    delta: dict[str, str], unfixed: list[Mismatch], label: str = None
+) -> None:
+    """
+    Print suggested fix as config fragment, with comments for the mismatches
+    no fix was found for.
+    """
+    if label:
+        print(f"# {label}")
+    for option, val in delta.items():
+        if val == "n":
+            print(f"# CONFIG_{option} is not set")
+        else:
+            print(f"CONFIG_{option}={val}")
+    for mismatch in unfixed:
+        spec = mismatch.spec
+        print(
+            f"# no fix found for {spec.option}={spec.value} "
+            f"(defined in {spec.file}:{spec.line})"
+        )
+
+
+def _mismatch_message(mismatch: Mismatch) -> str:
+    """
+    Describe mismatch between requested and actual value of an option.
+    """
+    spec = mismatch.spec
+    if mismatch.actual is None:
+        return f"{spec.option}={spec.value} not found"
+    return f"{spec.option}={spec.value} requested, actual = {mismatch.actual}"
+
+
+def print_mismatches(
+    mismatches: list[Mismatch], github_format: bool = False, label: str = None
+) -> None:
+    """
+    Print mismatches, prefixed with label (e.g. the board) if given.
+    """
+    for mismatch in mismatches:
+        message = _mismatch_message(mismatch)
+        if label:
+            message = f"{label}: {message}"
+        if mismatch.reasons and github_format:
+            # workflow commands take newlines in messages URL-encoded
+            message += "%0A" + "%0A".join(mismatch.reasons)
+        print(
+            _format_message(
+                message,
+                file=mismatch.spec.file,
+                line=mismatch.spec.line,
+                github_format=github_format,
+            )
+        )
+        if not github_format:
+            for reason in mismatch.reasons:
+                print(f"    {reason}")
+
+
+def _mismatch_record(mismatch: Mismatch, board: str) -> dict:
+    """
+    Return JSON-serializable representation of a mismatch.
+    """
+    spec = mismatch.spec
+    return {
+        "board": board,
+        "option": spec.option,
+        "requested": spec.value,
+        "actual": mismatch.actual,
+        "found": mismatch.actual is not None,
+        "file": spec.file,
+        "line": spec.line,
+        "reasons": list(mismatch.reasons),
+    }
+
+
+def _sarif_result(mismatch: Mismatch, board: str) -> dict:
+    """
+    Return SARIF result object for a mismatch.
+    """
+    spec = mismatch.spec
+    message = _mismatch_message(mismatch)
+    if mismatch.reasons:
+        message += "\n" + "\n".join(mismatch.reasons)
+    rule = "option-mismatch" if mismatch.actual is not None else "option-not-found"
+    return {
+        "ruleId": rule,
+        "level": "warning",
+        "message": {"text": f"{board}: {message}"},
+        "locations": [_sarif_location(spec)],
+        "properties": _mismatch_record(mismatch, board),
+    }
+
+
+def _sarif_document(
+    rules: list[str], results: list[dict], timings: dict[str, float]
+) -> dict:
+    """
+    Return SARIF document with results of the given rules and timings.
+    """
+    return {
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "version": "2.1.0",
+        "runs": [
+            {
+                "tool": {
+                    "driver": {
+                        "name": "check-dotconfig",
+                        "rules": [
+                            {
+                                "id": rule,
+                                "shortDescription": {"text": _SARIF_RULES[rule]},
+                            }
+                            for rule in rules
+                        ],
+                    }
+                },
+                "results": results,
+                "properties": {"timings": timings},
+            }
+        ],
+    }
+
+
+def _sarif_location(spec: OptionValue) -> dict:
+    """
+    Return SARIF location of the fragment line defining an option.
+    """
+    return {
+        "physicalLocation": {
+            "artifactLocation": {"uri": spec.file},
+            "region": {"startLine": spec.line},
+        }
+    }
+
+
+def dump_mismatches(
+    results: list[tuple[str, list[Mismatch]]],
+    timings: dict[str, float],
+    output_format: str = "json",
+) -> None:
+    """
+    Print (board, mismatches) results as JSON or SARIF document, including
+    timings (in seconds) of the individual checking steps.
+    """
+    timings = {step: round(seconds, 6) for step, seconds in timings.items()}
+
+    if output_format == "sarif":
+        document = _sarif_document(
+            ["option-mismatch", "option-not-found"],
+            [
+                _sarif_result(mismatch, board)
+                for board, mismatches in results
+                for mismatch in mismatches
+            ],
+            timings,
+        )
+    else:
+        document = {
+            "mismatches": [
+                _mismatch_record(mismatch, board)
+                for board, mismatches in results
+                for mismatch in mismatches
+            ],
+            "timings": timings,
+        }
+
+    json.dump(document, sys.stdout, indent=2)
+    print()
+
+
 def compare_configs(
     expected_options: dict[str, OptionValue],
     kconfig: Kconfig,
@@ -64,64 +770,975 @@ def compare_configs(
     """
     Compare dictionary of expected options with actual Kconfig representation.
     """
+    print_mismatches(find_mismatches(expected_options, kconfig), github_format)
+
+
+def _check_target(
+    actual_config: str,
+    expected_options: dict[str, OptionValue],
+    explain: bool = False,
+) -> tuple[list[Mismatch], float, float]:
+    """
+    Load actual config into the shared Kconfig tree and return its mismatches,
+    along with the time spent loading the config and comparing it.
+    """
+    start = time.perf_counter()
+    _shared_kconfig.load_config(actual_config)
+    loaded = time.perf_counter()
+    mismatches = find_mismatches(expected_options, _shared_kconfig)
+    if explain:
+        mismatches = explain_mismatches(mismatches, _shared_kconfig)
+    return mismatches, loaded - start, time.perf_counter() - loaded
+
+
+def check_targets(
+    kconfig: Kconfig,
+    targets: list[tuple[str, dict[str, OptionValue]]],
+    jobs: int = 1,
+    explain: bool = False,
+    timings: dict[str, float] = None,
+) -> list[list[Mismatch]]:
+    """
+    Check several (actual config, expected options) targets against one parsed
+    Kconfig tree and return the mismatches of each target.
+
+    If timings is given, the time spent loading the configs and comparing
+    them is added to its "load" and "compare" entries.
+
+    Loading a config only re-evaluates the symbols whose values change, so
+    targets are cheap to check one after another. With jobs > 1, targets are
+    checked in a pool of forked worker processes, which inherit the parsed
+    tree instead of parsing it again.
+    """
+    global _shared_kconfig
+    _shared_kconfig = kconfig
+
+    if jobs > 1 and len(targets) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(targets)),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as pool:
+            results = list(
+                pool.map(partial(_check_target, explain=explain), *zip(*targets))
+            )
+    else:
+        results = [
+            _check_target(config, options, explain) for config, options in targets
+        ]
+
+    if timings is not None:
+        for _, load_time, compare_time in results:
+            timings["load"] = timings.get("load", 0.0) + load_time
+            timings["compare"] = timings.get("compare", 0.0) + compare_time
+
+    return [mismatches for mismatches, _, _ in results]
+
+
+def find_fragment_stacks(br2_external: str) -> list[list[str]]:
+    """
+    Return lists of kernel config fragments (shared ones from kernel/ and the
+    board one) in the order the defconfigs of BR2_EXTERNAL tree apply them.
+    """
+    stacks: dict[tuple[str, ...], None] = {}
+
+    for defconfig in sorted(glob.glob(os.path.join(br2_external, "configs", "*"))):
+        with open(defconfig) as f:
+            if matches := defconfig_regex.search(f.read()):
+                stack = matches["fragments"].replace("$(BR2_EXTERNAL)", br2_external)
+                stacks[tuple(stack.split())] = None
+
+    return [list(stack) for stack in stacks]
+
+
+def _value_key(value: str, sym: Symbol) -> str:
+    """
+    Return canonical form of a requested value, so that e.g. "is not set" and
+    =n, or 0x10 and 16 for a hex symbol, are treated as the same value.
+    """
+    if value is None:
+        return "n"
+    if sym is not None:
+        if base := _NUMBER_BASES.get(sym.orig_type):
+            try:
+                return str(int(value, base))
+            except ValueError:
+                return value
+        if sym.orig_type is STRING and value[0] == '"':
+            return unescape(value[1:-1])
+    return value
+
+
+def analyze_fragments(
+    stacks: list[list[tuple[OptionValue, ...]]], kconfig: Kconfig
+) -> list[Finding]:
+    """
+    Return findings for options of fragment stacks (the definitions of the
+    fragments in the order they are applied to a board, see scan_fragment())
+    that are requested again with a conflicting or the same value, within a
+    fragment or across fragments, requested with their default value, or not
+    found in the Kconfig tree.
+
+    The options of each stack are indexed in a single pass, findings of
+    fragments shared by several stacks are only reported once. Defaults are
+    the values of the Kconfig tree without any config loaded, so whether the
+    first definition of an option is redundant is judged with all other
+    options at their defaults.
+    """
+    findings: dict[Finding, None] = {}
+    modules = kconfig.modules.tri_value != 0
+    # canonical values, computed once for options shared by several stacks
+    keys: dict[OptionValue, str] = {}
+
+    for fragments in stacks:
+        # option -> definition in effect and its canonical value
+        index: dict[str, tuple[OptionValue, str]] = {}
+
+        for specs in fragments:
+            for spec in specs:
+                option = spec.option
+                sym = kconfig.syms.get(option)
+                if (key := keys.get(spec)) is None:
+                    key = keys[spec] = _value_key(spec.value, sym)
+
+                if (entry := index.get(option)) is None:
+                    if sym is None or not sym.nodes:
+                        findings[Finding("unknown", spec)] = None
+                    elif _matches(spec.value, sym.str_value, sym.orig_type, modules):
+                        findings[Finding("default", spec)] = None
+                    index[option] = (spec, key)
+                    continue
+
+                # compare with the value in effect, not with earlier ones
+                # that were overridden in between
+                last, last_key = entry
+                kind = "duplicate" if key == last_key else "conflict"
+                findings[Finding(kind, spec, last)] = None
+                index[option] = (spec, key)
+
+    return list(findings)
+
+
+def _finding_message(finding: Finding) -> str:
+    """
+    Describe finding of the fragment analysis.
+    """
+    spec, other = finding.spec, finding.other
+    message = f"{spec.option}={spec.value}"
+    if finding.kind == "unknown":
+        return f"{message} not found"
+    if finding.kind == "default":
+        return f"{message} is already the default"
+    if finding.kind == "duplicate":
+        return f"{message} duplicates {other.file}:{other.line}"
+    return (
+        f"{message} conflicts with {spec.option}={other.value} "
+        f"from {other.file}:{other.line}"
+    )
+
+
+def print_findings(findings: list[Finding], github_format: bool = False) -> None:
+    """
+    Print findings of the fragment analysis.
+    """
+    for finding in findings:
+        print(
+            _format_message(
+                _finding_message(finding),
+                file=finding.spec.file,
+                line=finding.spec.line,
+                github_format=github_format,
+            )
+        )
+
+
+def _finding_record(finding: Finding) -> dict:
+    """
+    Return JSON-serializable representation of a finding.
+    """
+    spec, other = finding.spec, finding.other
+    record = {
+        "kind": finding.kind,
+        "option": spec.option,
+        "value": spec.value,
+        "file": spec.file,
+        "line": spec.line,
+        "other": None,
+    }
+    if other:
+        record["other"] = {"value": other.value, "file": other.file, "line": other.line}
+    return record
+
+
+def dump_findings(
+    findings: list[Finding],
+    timings: dict[str, float],
+    output_format: str = "json",
+) -> None:
+    """
+    Print findings of the fragment analysis as JSON or SARIF document,
+    including timings (in seconds) of the individual steps.
+    """
+    timings = {step: round(seconds, 6) for step, seconds in timings.items()}
+
+    if output_format == "sarif":
+        results = []
+        for finding in findings:
+            # unknown options are reported with the rule the checker uses
+            rule = "option-not-found" if finding.kind == "unknown" else finding.kind
+            results.append(
+                {
+                    "ruleId": rule,
+                    "level": "note" if finding.kind == "duplicate" else "warning",
+                    "message": {"text": _finding_message(finding)},
+                    "locations": [_sarif_location(finding.spec)],
+                    "properties": _finding_record(finding),
+                }
+            )
+        document = _sarif_document(
+            ["option-not-found", "default", "duplicate", "conflict"],
+            results,
+            timings,
+        )
+    else:
+        document = {
+            "findings": [_finding_record(finding) for finding in findings],
+            "timings": timings,
+        }
+
+    json.dump(document, sys.stdout, indent=2)
+    print()
+
+
+def _file_digest(filename: str) -> str:
+    """
+    Return SHA-256 digest of file contents.
+    """
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _tree_stamps(kconfig_files: list[str]) -> list[list]:
+    """
+    Return [path, modification time, size] of each file of a Kconfig tree, with
+    None modification time and size for missing files.
+    """
+    return [[path, *(_file_stamp(path) or (None, None))] for path in kconfig_files]
+
+
+def load_state(
+    filename: str, src_kconfig: str, explain: bool = False
+) -> tuple[dict, list[list]]:
+    """
+    Load per-target results of a previous run and the stamps of the Kconfig
+    files it parsed (see _tree_stamps()) from state file. Results of a run
+    against another Kconfig tree, a tree with any file changed since, or with
+    different --explain are discarded.
+    """
+    try:
+        with open(filename) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}, []
+
+    if (
+        state.get("version") != STATE_VERSION
+        or state.get("kconfig") != src_kconfig
+        or state.get("explain") != explain
+        or not (tree := state.get("tree"))
+        or _tree_stamps([path for path, *_ in tree]) != tree
+    ):
+        return {}, []
+    return state["targets"], tree
+
+
+def save_state(
+    filename: str,
+    targets: dict,
+    tree: list[list],
+    src_kconfig: str,
+    explain: bool = False,
+) -> None:
+    """
+    Write per-target results and Kconfig file stamps to state file, replacing
+    it atomically.
+    """
+    state = {
+        "version": STATE_VERSION,
+        "kconfig": src_kconfig,
+        "explain": explain,
+        "tree": tree,
+        "targets": targets,
+    }
+    with open(f"{filename}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def _stored_results(
+    target_state: dict,
+) -> tuple[dict[str, OptionValue], dict[str, Mismatch]]:
+    """
+    Return expected options and results (None for matching options) stored
+    for a target.
+    """
+    expected_options: dict[str, OptionValue] = {}
+    results: dict[str, Mismatch] = {}
+
+    for option, entry in target_state["options"].items():
+        requested, file, line, actual, reasons = entry
+        spec = expected_options[option] = OptionValue(option, requested, file, line)
+        if reasons is None:
+            results[option] = None
+        else:
+            results[option] = Mismatch(spec, actual, tuple(reasons))
+
+    return expected_options, results
+
+
+def _reuse_results(
+    target_state: dict, expected_options: dict[str, OptionValue], explain: bool
+) -> tuple[dict[str, Mismatch], dict[str, OptionValue]]:
+    """
+    Split expected options of a target whose actual config didn't change into
+    results reused from its state (None for matching options) and options that
+    have to be checked against the Kconfig tree.
+    """
+    stored = target_state["options"]
+    reused: dict[str, Mismatch] = {}
+    pending: dict[str, OptionValue] = {}
+
     for option, spec in expected_options.items():
-        if option not in kconfig.syms:
-            print(
-                _format_message(
-                    f"{option}={spec.value} not found",
-                    file=spec.file,
-                    line=spec.line,
-                    github_format=github_format,
+        if (entry := stored.get(option)) is None:
+            pending[option] = spec
+            continue
+
+        requested, _, _, actual, reasons = entry
+        if requested == spec.value:
+            if reasons is None:
+                reused[option] = None
+            else:
+                reused[option] = Mismatch(spec, actual, tuple(reasons))
+        elif reasons is None or spec.value not in ("y", "n"):
+            # only actual values of mismatches are stored, and comparing other
+            # values than y/n depends on the symbol type
+            pending[option] = spec
+        elif _matches(spec.value, actual):
+            reused[option] = None
+        elif explain and actual is not None:
+            # reasons depend on the requested value, they have to be computed
+            pending[option] = spec
+        else:
+            reused[option] = Mismatch(spec, actual)
+
+    return reused, pending
+
+
+def _target_state(
+    config_digest: str,
+    fragment_digests: list[list[str]],
+    expected_options: dict[str, OptionValue],
+    results: dict[str, Mismatch],
+) -> dict:
+    """
+    Return JSON-serializable state of a checked target. Matching options are
+    stored with None actual value and reasons.
+    """
+    options = {}
+    for option, spec in expected_options.items():
+        actual = reasons = None
+        if mismatch := results[option]:
+            actual, reasons = mismatch.actual, list(mismatch.reasons)
+        options[option] = [spec.value, spec.file, spec.line, actual, reasons]
+
+    return {
+        "config": config_digest,
+        "fragments": fragment_digests,
+        "options": options,
+    }
+
+
+def check_targets_incremental(
+    src_kconfig: str,
+    targets: list[tuple[str, list[str]]],
+    state: dict,
+    tree: list[list],
+    strip_path_prefix: str = None,
+    jobs: int = 1,
+    explain: bool = False,
+    timings: dict[str, float] = None,
+) -> list[list[Mismatch]]:
+    """
+    Check (actual config, fragments) targets like check_targets(), reusing the
+    results of the previous run stored in state, which is updated in place
+    like the Kconfig file stamps in tree whenever the Kconfig tree is parsed.
+
+    If neither the actual config nor the fragments of a target changed, its
+    results are taken over without even parsing the fragments. If only the
+    fragments changed, results of options with unchanged requested values are
+    reused, as are the stored actual values of mismatched options requested
+    to be y/n now, so mostly new and changed options are checked. Targets with
+    a changed actual config are fully checked. The Kconfig tree is only parsed
+    if any option has to be checked.
+    """
+    if timings is None:
+        timings = {}
+    timings.setdefault("fragments", 0.0)
+
+    digests: dict[str, str] = {}
+    plans: list[tuple[str, list, dict, dict]] = []
+    pending: list[tuple[int, str, dict[str, OptionValue]]] = []
+
+    for actual_config, fragments in targets:
+        for path in [actual_config, *fragments]:
+            if path not in digests:
+                digests[path] = _file_digest(path)
+        fragment_digests = [[f, digests[f]] for f in fragments]
+
+        target_state = state.get(actual_config)
+        if target_state and target_state["config"] != digests[actual_config]:
+            target_state = None
+
+        if target_state and target_state["fragments"] == fragment_digests:
+            expected_options, results = _stored_results(target_state)
+        else:
+            start = time.perf_counter()
+            expected_options = merge_fragments(fragments, strip_path_prefix)
+            timings["fragments"] += time.perf_counter() - start
+
+            if target_state:
+                results, todo = _reuse_results(
+                    target_state, expected_options, explain
                 )
-            )
-        elif (val := kconfig.syms[option].str_value) != spec.value:
-            if spec.value is None and val == "n":
-                continue
+            else:
+                results, todo = {}, expected_options
+            if todo:
+                pending.append((len(plans), actual_config, todo))
+
+        plans.append((actual_config, fragment_digests, expected_options, results))
+
+    if pending:
+        start = time.perf_counter()
+        kconfig = Kconfig(src_kconfig, warn_to_stderr=False)
+        timings["kconfig"] = time.perf_counter() - start
+        tree[:] = _tree_stamps(
+            [os.path.join(kconfig.srctree, f) for f in kconfig.kconfig_filenames]
+        )
+
+        checked = check_targets(
+            kconfig,
+            [(actual_config, todo) for _, actual_config, todo in pending],
+            jobs=jobs,
+            explain=explain,
+            timings=timings,
+        )
+        for (i, _, todo), mismatches in zip(pending, checked):
+            results = plans[i][3]
+            results.update(dict.fromkeys(todo))
+            results.update((m.spec.option, m) for m in mismatches)
+
+    output: list[list[Mismatch]] = []
+    for actual_config, fragment_digests, expected_options, results in plans:
+        state[actual_config] = _target_state(
+            digests[actual_config], fragment_digests, expected_options, results
+        )
+        output.append([m for option in expected_options if (m := results[option])])
+
+    return output
+
+
+def _file_stamp(filename: str) -> tuple[int, int]:
+    """
+    Return modification time and size of file, None if it doesn't exist (e.g.
+    while an editor replaces it).
+    """
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def watch(
+    args: argparse.Namespace,
+    targets: list[tuple[str, list[str]]],
+    interval: float = 0.5,
+) -> None:
+    """
+    Check targets whenever their actual configs or fragments change, polling
+    them every interval seconds until interrupted.
+
+    The Kconfig tree is only parsed once. On a change, parse_fragment() only
+    parses the changed fragments again, and an actual config is only loaded
+    again if it changed or another target's config was loaded since.
+    """
+    kconfig = Kconfig(args.src_kconfig, warn_to_stderr=False)
+    paths = list(
+        dict.fromkeys(
+            path for config, fragments in targets for path in [config, *fragments]
+        )
+    )
+    stamps: dict[str, tuple[int, int]] = {}
+    loaded = None
+
+    while True:
+        current = {path: _file_stamp(path) for path in paths}
+        if current == stamps or None in current.values():
+            time.sleep(interval)
+            continue
+        stamps = current
+
+        start = time.perf_counter()
+        count = 0
+        for actual_config, fragments in targets:
+            expected_options = merge_fragments(fragments, args.strip_path_prefix)
+            if loaded != (actual_config, stamps[actual_config]):
+                kconfig.load_config(actual_config)
+                loaded = (actual_config, stamps[actual_config])
+
+            mismatches = find_mismatches(expected_options, kconfig)
+            if args.explain:
+                mismatches = explain_mismatches(mismatches, kconfig)
+            count += len(mismatches)
+
+            label = None
+            if len(targets) > 1:
+                label = _strip_prefix(actual_config, args.strip_path_prefix)
+            print_mismatches(mismatches, args.github_format, label)
+
+        elapsed = (time.perf_counter() - start) * 1000
+        print(
+            f"# {time.strftime('%H:%M:%S')}: {count} mismatches "
+            f"(checked in {elapsed:.1f} ms)",
+            flush=True,
+        )
+
+
+def suggest(args: argparse.Namespace, targets: list[tuple[str, list[str]]]) -> None:
+    """
+    Print fragment with the assignments that fix the mismatches of each target
+    (see --suggest-fix).
+    """
+    kconfig = Kconfig(args.src_kconfig, warn_to_stderr=False)
+
+    for actual_config, fragments in targets:
+        expected_options = merge_fragments(fragments, args.strip_path_prefix)
+        kconfig.load_config(actual_config)
+        mismatches = find_mismatches(expected_options, kconfig)
+        delta, unfixed = suggest_fix(mismatches, expected_options, kconfig)
+
+        label = None
+        if len(targets) > 1:
+            label = _strip_prefix(actual_config, args.strip_path_prefix)
+        print_fix(delta, unfixed, label)
+
+
+def _fragment_stacks(args: argparse.Namespace) -> list[list[tuple[OptionValue, ...]]]:
+    """
+    Return scanned fragment stacks given on the command line, or of all
+    BR2_EXTERNAL defconfigs if no fragments are given.
+    """
+    if args.fragments:
+        stacks = [args.fragments]
+    else:
+        br2_external = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        stacks = find_fragment_stacks(br2_external)
+    # scan_fragment() only scans fragments shared by several stacks once
+    return [
+        [scan_fragment(f, args.strip_path_prefix) for f in stack] for stack in stacks
+    ]
+
+
+def _scan_kconfig(
+    src_kconfig: str, options: frozenset[str]
+) -> tuple[dict[str, tuple[str, str]], dict[str, list[str]], frozenset[str]]:
+    """
+    Parse Kconfig tree and return type and prompt of the given options defined
+    in it, names of the defined symbols by prompt, and all defined names.
+
+    Runs in a worker process, which sets srctree to the directory of the
+    top-level Kconfig file, so that trees of several kernels can be parsed.
+    """
+    src_kconfig = os.path.abspath(src_kconfig)
+    os.environ["srctree"] = os.path.dirname(src_kconfig)
+    kconfig = Kconfig(src_kconfig, warn_to_stderr=False)
+
+    info: dict[str, tuple[str, str]] = {}
+    prompts: dict[str, list[str]] = {}
+    for sym in kconfig.unique_defined_syms:
+        prompt = next((node.prompt[0] for node in sym.nodes if node.prompt), None)
+        if sym.name in options:
+            info[sym.name] = (TYPE_TO_STR[sym.orig_type], prompt)
+        if prompt:
+            prompts.setdefault(prompt, []).append(sym.name)
+
+    return info, prompts, frozenset(sym.name for sym in kconfig.unique_defined_syms)
+
+
+def compare_kconfigs(
+    index: dict[str, OptionValue],
+    trees: list[tuple[str, dict, dict, frozenset]],
+) -> list[Incompatibility]:
+    """
+    Return options of the fragment index that are missing or renamed in some
+    of the scanned (path, info, prompts, names) Kconfig trees, or have another
+    type than in the first tree defining them.
+
+    An option is considered renamed if a symbol with the same prompt, which
+    isn't defined in the tree the option is found in, exists.
+    """
+    incompatibilities: list[Incompatibility] = []
+
+    for option, spec in index.items():
+        defined = [
+            (path, info[option], names)
+            for path, info, _, names in trees
+            if option in info
+        ]
+
+        for path, info, prompts, _ in trees:
+            if (sym_info := info.get(option)) is None:
+                candidates = {
+                    name: None
+                    for _, (_, prompt), names in defined
+                    for name in prompts.get(prompt, ())
+                    if name not in names
+                }
+                if candidates:
+                    detail = ", ".join(candidates)
+                    incompatibilities.append(
+                        Incompatibility(path, "renamed", spec, detail)
+                    )
+                else:
+                    incompatibilities.append(
+                        Incompatibility(path, "missing", spec, None)
+                    )
+            elif (ref_type := defined[0][1][0]) != sym_info[0]:
+                detail = f"{ref_type} in {defined[0][0]}, {sym_info[0]} here"
+                incompatibilities.append(Incompatibility(path, "retyped", spec, detail))
+
+    return incompatibilities
+
+
+def _incompatibility_message(incompatibility: Incompatibility) -> str:
+    """
+    Describe incompatibility of an option with a Kconfig tree.
+    """
+    spec = incompatibility.spec
+    message = f"{incompatibility.tree}: {spec.option}={spec.value}"
+    if incompatibility.kind == "missing":
+        return f"{message} not found"
+    if incompatibility.kind == "renamed":
+        return f"{message} not found, renamed to {incompatibility.detail}?"
+    return f"{message} changed type ({incompatibility.detail})"
+
+
+def compat(args: argparse.Namespace) -> None:
+    """
+    Scan several Kconfig trees for fragment options that are missing, renamed
+    or retyped in them (see --compat) and print the results.
+
+    The fragments are indexed once, and only the options of the index are
+    passed to the worker processes parsing the trees, so scanning several
+    trees takes about as long as parsing the largest of them with enough jobs.
+    """
+    timings: dict[str, float] = {}
+    start = time.perf_counter()
+
+    # first definition of each option, for the location in the output
+    index: dict[str, OptionValue] = {}
+    for fragments in _fragment_stacks(args):
+        for specs in fragments:
+            for spec in specs:
+                index.setdefault(spec.option, spec)
+
+    timings["fragments"] = time.perf_counter() - start
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(
+        max_workers=min(args.jobs, len(args.src_kconfig)),
+        mp_context=multiprocessing.get_context("fork"),
+    ) as pool:
+        scans = pool.map(
+            partial(_scan_kconfig, options=frozenset(index)), args.src_kconfig
+        )
+        trees = [
+            (_strip_prefix(path, args.strip_path_prefix), *scan)
+            for path, scan in zip(args.src_kconfig, scans)
+        ]
+
+    timings["kconfig"] = time.perf_counter() - start
+    start = time.perf_counter()
+
+    incompatibilities = compare_kconfigs(index, trees)
+
+    timings["compare"] = time.perf_counter() - start
+
+    if args.format == "text":
+        for incompatibility in incompatibilities:
             print(
                 _format_message(
-                    f"{option}={spec.value} requested, actual = {val}",
-                    file=spec.file,
-                    line=spec.line,
-                    github_format=github_format,
+                    _incompatibility_message(incompatibility),
+                    file=incompatibility.spec.file,
+                    line=incompatibility.spec.line,
+                    github_format=args.github_format,
                 )
             )
+        return
+
+    timings = {step: round(seconds, 6) for step, seconds in timings.items()}
+    records = [
+        {
+            "tree": incompatibility.tree,
+            "kind": incompatibility.kind,
+            "option": incompatibility.spec.option,
+            "value": incompatibility.spec.value,
+            "file": incompatibility.spec.file,
+            "line": incompatibility.spec.line,
+            "detail": incompatibility.detail,
+        }
+        for incompatibility in incompatibilities
+    ]
+    if args.format == "sarif":
+        rules = {
+            "missing": "option-not-found",
+            "renamed": "renamed",
+            "retyped": "retyped",
+        }
+        document = _sarif_document(
+            list(rules.values()),
+            [
+                {
+                    "ruleId": rules[incompatibility.kind],
+                    "level": "warning",
+                    "message": {"text": _incompatibility_message(incompatibility)},
+                    "locations": [_sarif_location(incompatibility.spec)],
+                    "properties": record,
+                }
+                for incompatibility, record in zip(incompatibilities, records)
+            ],
+            timings,
+        )
+    else:
+        document = {"incompatibilities": records, "timings": timings}
+
+    json.dump(document, sys.stdout, indent=2)
+    print()
+
+
+def analyze(args: argparse.Namespace) -> None:
+    """
+    Run fragment analysis (see --analyze) and print its findings.
+    """
+    timings: dict[str, float] = {}
+    start = time.perf_counter()
+
+    fragments = _fragment_stacks(args)
+
+    timings["fragments"] = time.perf_counter() - start
+    start = time.perf_counter()
+
+    kconfig = Kconfig(args.src_kconfig, warn_to_stderr=False)
+
+    timings["kconfig"] = time.perf_counter() - start
+    start = time.perf_counter()
+
+    findings = analyze_fragments(fragments, kconfig)
+
+    timings["analysis"] = time.perf_counter() - start
+
+    if args.format != "text":
+        dump_findings(findings, timings, args.format)
+    else:
+        print_findings(findings, args.github_format)
 
 
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "--src-kconfig", help="Path to top-level Kconfig file", required=True
+        "--src-kconfig",
+        action="append",
+        required=True,
+        help="Path to top-level Kconfig file, can be given several times with "
+        "--compat",
     )
     parser.add_argument(
         "--actual-config",
         help="Path to config with actual config values (.config)",
-        required=True,
+    )
+    parser.add_argument(
+        "--target",
+        action="append",
+        nargs="+",
+        metavar=("ACTUAL_CONFIG", "FRAGMENT"),
+        help="Check ACTUAL_CONFIG against FRAGMENTs, can be given several "
+        "times to check several boards against one parsed Kconfig tree",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to check targets in parallel",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Explain mismatches by their unmet dependencies and blocking selects",
     )
     parser.add_argument(
         "--github-format",
         action="store_true",
         help="Use Github Workflow commands output format",
     )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="Report conflicting, duplicate, default and unknown options across "
+        "fragments instead of checking a config, analyzes the kernel fragments "
+        "of all BR2_EXTERNAL defconfigs if no fragments are given",
+    )
+    parser.add_argument(
+        "--suggest-fix",
+        action="store_true",
+        help="Print fragment with the additional assignments (enabled "
+        "dependencies, disabled selectors) that make the requested values "
+        "take effect, instead of the mismatches",
+    )
+    parser.add_argument(
+        "--watch",
+        nargs="?",
+        type=float,
+        const=0.5,
+        metavar="SECONDS",
+        help="Keep the parsed Kconfig tree and check again whenever the actual "
+        "configs or fragments change, polling them every SECONDS (default 0.5)",
+    )
+    parser.add_argument(
+        "--compat",
+        action="store_true",
+        help="Report fragment options that are missing, renamed or retyped in "
+        "any of the --src-kconfig trees (e.g. of the old and new kernel), "
+        "parsed in parallel with --jobs; fragments default to the ones of all "
+        "BR2_EXTERNAL defconfigs",
+    )
+    parser.add_argument(
+        "--state",
+        help="Path to state file with the results of the previous run, only "
+        "options from changed fragments or configs are checked again",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("text", "json", "sarif"),
+        default="text",
+        help="Output format, json and sarif include timings of the checking steps",
+    )
     parser.add_argument(
         "-s",
         "--strip-path-prefix",
         help="Path prefix to strip in the output from config fragment paths",
     )
-    parser.add_argument("fragments", nargs="+", help="Paths to source config fragments")
+    parser.add_argument("fragments", nargs="*", help="Paths to source config fragments")
 
     args = parser.parse_args()
 
-    expected_options: dict[str, OptionValue] = {}
+    if args.compat:
+        if args.actual_config or args.target or args.analyze:
+            parser.error(
+                "--compat can't be used with --actual-config, --target or --analyze"
+            )
+        compat(args)
+        return
+    if len(args.src_kconfig) > 1:
+        parser.error("--src-kconfig can only be given several times with --compat")
+    args.src_kconfig = args.src_kconfig[0]
+
+    if args.analyze:
+        if args.actual_config or args.target:
+            parser.error("--analyze can't be used with --actual-config or --target")
+        analyze(args)
+        return
 
-    for f in args.fragments:
-        expected_options.update(
-            parse_fragment(f, strip_path_prefix=args.strip_path_prefix)
+    targets: list[tuple[str, list[str]]] = []
+    if args.actual_config:
+        if not args.fragments:
+            parser.error("--actual-config requires at least one fragment")
+        targets.append((args.actual_config, args.fragments))
+    elif args.fragments:
+        parser.error("fragments given without --actual-config")
+    for target in args.target or []:
+        if len(target) < 2:
+            parser.error("--target requires ACTUAL_CONFIG and at least one FRAGMENT")
+        targets.append((target[0], target[1:]))
+    if not targets:
+        parser.error("either --actual-config or --target is required")
+
+    if args.suggest_fix:
+        if args.format != "text" or args.state or args.watch is not None:
+            parser.error(
+                "--suggest-fix can't be used with --format, --state or --watch"
+            )
+        suggest(args, targets)
+        return
+
+    if args.watch is not None:
+        if args.format != "text" or args.state:
+            parser.error("--watch only supports text output without --state")
+        try:
+            watch(args, targets, args.watch)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    timings: dict[str, float] = {}
+
+    if args.state:
+        state, tree = load_state(args.state, args.src_kconfig, args.explain)
+        results = check_targets_incremental(
+            args.src_kconfig,
+            targets,
+            state,
+            tree,
+            strip_path_prefix=args.strip_path_prefix,
+            jobs=args.jobs,
+            explain=args.explain,
+            timings=timings,
         )
+        save_state(args.state, state, tree, args.src_kconfig, args.explain)
+    else:
+        start = time.perf_counter()
 
-    kconfig = Kconfig(args.src_kconfig, warn_to_stderr=False)
-    kconfig.load_config(args.actual_config)
+        # fragments shared between targets are only parsed once, see
+        # parse_fragment()
+        expected = [
+            (actual_config, merge_fragments(fragments, args.strip_path_prefix))
+            for actual_config, fragments in targets
+        ]
+
+        timings["fragments"] = time.perf_counter() - start
+        start = time.perf_counter()
+
+        kconfig = Kconfig(args.src_kconfig, warn_to_stderr=False)
+
+        timings["kconfig"] = time.perf_counter() - start
+
+        results = check_targets(
+            kconfig, expected, jobs=args.jobs, explain=args.explain, timings=timings
+        )
+
+    if args.format != "text":
+        boards = [
+            _strip_prefix(config, args.strip_path_prefix) for config, _ in targets
+        ]
+        dump_mismatches(list(zip(boards, results)), timings, args.format)
+        return
+
+    for (actual_config, _), mismatches in zip(targets, results):
+        # only label the messages when there is more than one board
+        label = None
+        if len(targets) > 1:
+            label = _strip_prefix(actual_config, args.strip_path_prefix)
 
-    compare_configs(expected_options, kconfig, github_format=args.github_format)
+        print_mismatches(mismatches, args.github_format, label)
 
 
 if __name__ == "__main__":
@@ -811,6 +811,7 @@ class Kconfig(object):
       See the module docstring.
     """
     __slots__ = (
+        "_autoconf_lines",
         "_encoding",
         "_functions",
         "_set_match",
@@ -985,6 +986,9 @@ class Kconfig(object):
         self.config_header = os.getenv("KCONFIG_CONFIG_HEADER", "")
         self.header_header = os.getenv("KCONFIG_AUTOHEADER_HEADER", "")
 
+        # See _autoconf_contents()
+        self._autoconf_lines = {}
+
         self.syms = {}
         self.const_syms = {}
         self.defined_syms = []
@@ -1261,109 +1265,123 @@ class Kconfig(object):
                 for choice in self.unique_choices:
                     choice._was_set = False
 
-            # Small optimizations
-            set_match = self._set_match
-            unset_match = self._unset_match
-            get_sym = self.syms.get
+            # Small optimization
+            parse_line = self._parse_config_line
 
             for linenr, line in enumerate(f, 1):
-                # The C tools ignore trailing whitespace
-                line = line.rstrip()
-
-                match = set_match(line)
-                if match:
-                    name, val = match.groups()
-                    sym = get_sym(name)
-                    if not sym or not sym.nodes:
-                        self._undef_assign(name, val, filename, linenr)
-                        continue
+                assignment = parse_line(line, filename, linenr)
+                if not assignment:
+                    continue
 
-                    if sym.orig_type in _BOOL_TRISTATE:
-                        # The C implementation only checks the first character
-                        # to the right of '=', for whatever reason
-                        if not (sym.orig_type is BOOL
-                                and val.startswith(("y", "n")) or
-                                sym.orig_type is TRISTATE
-                                and val.startswith(("y", "m", "n"))):
-                            self._warn("'{}' is not a valid value for the {} "
-                                       "symbol {}. Assignment ignored."
-                                       .format(val, TYPE_TO_STR[sym.orig_type],
-                                               sym.name_and_loc),
-                                       filename, linenr)
-                            continue
+                # Done parsing the assignment. Set the value.
 
-                        val = val[0]
+                sym, val = assignment
 
-                        if sym.choice and val != "n":
-                            # During .config loading, we infer the mode of the
-                            # choice from the kind of values that are assigned
-                            # to the choice symbols
+                if sym._was_set:
+                    self._assigned_twice(sym, val, filename, linenr)
 
-                            prev_mode = sym.choice.user_value
-                            if prev_mode is not None and \
-                               TRI_TO_STR[prev_mode] != val:
+                sym.set_value(val)
 
-                                self._warn("both m and y assigned to symbols "
-                                           "within the same choice",
-                                           filename, linenr)
+        if replace:
+            self._unset_unassigned()
 
-                            # Set the choice's mode
-                            sym.choice.set_value(val)
+    def _parse_config_line(self, line, filename, linenr):
+        # Parses a line from a .config file. Returns a (sym, val) tuple for
+        # assignments to defined symbols, where 'val' is in the format expected
+        # by Symbol.set_value(), and None for other lines. Warns about
+        # malformed lines and invalid values.
+        #
+        # As a side effect, the mode of the choice is set for assignments to
+        # choice symbols. During .config loading, we infer the mode of the
+        # choice from the kind of values that are assigned to the choice
+        # symbols.
 
-                    elif sym.orig_type is STRING:
-                        match = _conf_string_match(val)
-                        if not match:
-                            self._warn("malformed string literal in "
-                                       "assignment to {}. Assignment ignored."
-                                       .format(sym.name_and_loc),
-                                       filename, linenr)
-                            continue
+        # The C tools ignore trailing whitespace
+        line = line.rstrip()
 
-                        val = unescape(match.group(1))
+        match = self._set_match(line)
+        if match:
+            name, val = match.groups()
+            sym = self.syms.get(name)
+            if not sym or not sym.nodes:
+                self._undef_assign(name, val, filename, linenr)
+                return None
 
-                else:
-                    match = unset_match(line)
-                    if not match:
-                        # Print a warning for lines that match neither
-                        # set_match() nor unset_match() and that are not blank
-                        # lines or comments. 'line' has already been
-                        # rstrip()'d, so blank lines show up as "" here.
-                        if line and not line.lstrip().startswith("#"):
-                            self._warn("ignoring malformed line '{}'"
-                                       .format(line),
-                                       filename, linenr)
+            if sym.orig_type in _BOOL_TRISTATE:
+                # The C implementation only checks the first character
+                # to the right of '=', for whatever reason
+                if not (sym.orig_type is BOOL
+                        and val.startswith(("y", "n")) or
+                        sym.orig_type is TRISTATE
+                        and val.startswith(("y", "m", "n"))):
+                    self._warn("'{}' is not a valid value for the {} "
+                               "symbol {}. Assignment ignored."
+                               .format(val, TYPE_TO_STR[sym.orig_type],
+                                       sym.name_and_loc),
+                               filename, linenr)
+                    return None
+
+                val = val[0]
+
+                if sym.choice and val != "n":
+                    prev_mode = sym.choice.user_value
+                    if prev_mode is not None and \
+                       TRI_TO_STR[prev_mode] != val:
+
+                        self._warn("both m and y assigned to symbols "
+                                   "within the same choice",
+                                   filename, linenr)
+
+                    # Set the choice's mode
+                    sym.choice.set_value(val)
 
-                        continue
+            elif sym.orig_type is STRING:
+                match = _conf_string_match(val)
+                if not match:
+                    self._warn("malformed string literal in "
+                               "assignment to {}. Assignment ignored."
+                               .format(sym.name_and_loc),
+                               filename, linenr)
+                    return None
 
-                    name = match.group(1)
-                    sym = get_sym(name)
-                    if not sym or not sym.nodes:
-                        self._undef_assign(name, "n", filename, linenr)
-                        continue
+                val = unescape(match.group(1))
 
-                    if sym.orig_type not in _BOOL_TRISTATE:
-                        continue
+            return (sym, val)
 
-                    val = "n"
+        match = self._unset_match(line)
+        if not match:
+            # Print a warning for lines that match neither
+            # set_match() nor unset_match() and that are not blank
+            # lines or comments. 'line' has already been
+            # rstrip()'d, so blank lines show up as "" here.
+            if line and not line.lstrip().startswith("#"):
+                self._warn("ignoring malformed line '{}'".format(line),
+                           filename, linenr)
 
-                # Done parsing the assignment. Set the value.
+            return None
 
-                if sym._was_set:
-                    self._assigned_twice(sym, val, filename, linenr)
+        name = match.group(1)
+        sym = self.syms.get(name)
+        if not sym or not sym.nodes:
+            self._undef_assign(name, "n", filename, linenr)
+            return None
 
-                sym.set_value(val)
+        if sym.orig_type not in _BOOL_TRISTATE:
+            return None
 
-        if replace:
-            # If we're replacing the configuration, unset the symbols that
-            # didn't get set
+        return (sym, "n")
 
-            for sym in self.unique_defined_syms:
-                if not sym._was_set:
-                    sym.unset_value()
+    def _unset_unassigned(self):
+        # Helper for replacing the configuration. Unsets the symbols and
+        # choices that didn't get set (that have _was_set False).
 
-            for choice in self.unique_choices:
-                if not choice._was_set:
-                    choice.unset_value()
+        for sym in self.unique_defined_syms:
+            if not sym._was_set:
+                sym.unset_value()
+
+        for choice in self.unique_choices:
+            if not choice._was_set:
+                choice.unset_value()
 
     def _undef_assign(self, name, val, filename, linenr):
         # Called for assignments to undefined symbols during .config loading
@@ -1414,6 +1432,191 @@ class Kconfig(object):
         """
         load_allconfig(self, filename)
 
+    def eval_configs(self, filenames):
+        """
+        Evaluates several configuration files against the already-parsed
+        Kconfig tree and returns the resulting symbol values for each of them,
+        together with the symbols whose values differ between them. Useful for
+        checking many configurations (e.g. the defconfigs for several boards)
+        without creating a separate Kconfig instance for each.
+
+        The files are loaded one after another with load_config() (with
+        replace=True). Loading a configuration only invalidates the symbols
+        whose user values actually change, so each configuration after the
+        first only costs a re-evaluation of the parts where it differs from
+        the previous one. The configuration from the last file is left loaded
+        when the function returns.
+
+        See the Kconfig.__init__() docstring for raised exceptions
+        (OSError/IOError). KconfigError is never raised here.
+
+        filenames:
+          List of paths to load configurations from. Respects $srctree if set,
+          like load_config().
+
+        Returns a (values, diff) tuple:
+
+          values:
+            A list with one dictionary per configuration file, in the same
+            order as 'filenames'. Each dictionary maps the names of all defined
+            symbols to their string value (Symbol.str_value) in that
+            configuration.
+
+          diff:
+            A dictionary that maps the name of each symbol whose value differs
+            between at least two of the configurations to a tuple with the
+            symbol's value in each configuration, in 'filenames' order.
+        """
+        values = []
+        for filename in filenames:
+            self.load_config(filename)
+            values.append({sym.name: sym.str_value
+                           for sym in self.unique_defined_syms})
+
+        diff = {}
+        if len(values) > 1:
+            for sym in self.unique_defined_syms:
+                name = sym.name
+                vals = tuple([config_vals[name] for config_vals in values])
+                if vals.count(vals[0]) != len(vals):
+                    diff[name] = vals
+
+        return values, diff
+
+    def merge_configs(self, filenames, replace=True):
+        """
+        Merges a list of configuration files, e.g. a defconfig followed by a
+        number of configuration fragments, and loads the result. Assignments
+        in later files override assignments in earlier files, giving the same
+        symbol values as calling load_config() with replace=False for each
+        file in turn.
+
+        Unlike with repeated load_config() calls, all files are read first,
+        and the merged values are then assigned in a single batch. All cached
+        values are invalidated once before the batch, which makes the
+        assignments cheap, and symbols get evaluated once afterwards. Multiple
+        assignments to the same symbol are reported in the return value
+        instead of generating warnings (see Kconfig.warn_assign_override and
+        Kconfig.warn_assign_redun). Other warnings are generated as for
+        load_config().
+
+        Kconfig.missing_syms is updated as for load_config().
+
+        See the Kconfig.__init__() docstring for raised exceptions
+        (OSError/IOError). KconfigError is never raised here.
+
+        filenames:
+          List of paths to configuration files, in the order they should be
+          merged. Respects $srctree if set, like load_config().
+
+        replace (default: True):
+          If True, all existing user values are cleared before merging, so
+          that the result only reflects 'filenames'. Pass False to merge the
+          files on top of the current configuration.
+
+        Returns a (merged, overridden, redundant) tuple. Assignments are
+        represented as (value, filename, linenr) tuples, where 'value' is "n",
+        "m", or "y" for bool/tristate symbols and a string for other symbol
+        types (with any quotes and escapes removed for string symbols).
+
+          merged:
+            A dictionary mapping the names of all assigned symbols to the
+            assignment that took effect (the last one).
+
+          overridden:
+            A list of (name, old, new) tuples for assignments that were
+            overridden by a later assignment of a different value. 'old' is
+            the overridden assignment and 'new' the overriding one.
+
+          redundant:
+            Like 'overridden', for later assignments that set the same value
+            again.
+        """
+        if replace:
+            self.missing_syms = []
+
+            # See _load_config()
+            for sym in self.unique_defined_syms:
+                sym._was_set = False
+
+            for choice in self.unique_choices:
+                choice._was_set = False
+
+        # Maps symbols to their effective assignment. Symbols are reinserted
+        # when overridden, so that the assignments are applied in the order
+        # of their last occurrence. This matters for choices, where the last
+        # choice symbol set to y becomes the user selection.
+        merged = {}
+        overridden = []
+        redundant = []
+
+        # Maps choices to the choice symbol last set to y. With repeated
+        # load_config() calls, it remains the user selection even if a later
+        # assignment sets it to n, which the merged values don't reflect.
+        selections = {}
+
+        # See load_config()
+        self._warn_assign_no_prompt = False
+        try:
+            parse_line = self._parse_config_line
+
+            for filename in filenames:
+                try:
+                    with self._open_config(filename) as f:
+                        for linenr, line in enumerate(f, 1):
+                            assignment = parse_line(line, filename, linenr)
+                            if not assignment:
+                                continue
+
+                            sym, val = assignment
+
+                            # Invalid int/hex values are ignored by
+                            # set_value(), so they must not override earlier
+                            # assignments. Bool/tristate and string values
+                            # have already been checked.
+                            if sym.orig_type in _INT_HEX and \
+                               not sym._is_valid_value(val):
+                                sym._warn_invalid_value(val)
+                                continue
+
+                            new = (val, filename, linenr)
+
+                            old = merged.pop(sym, None)
+                            if old:
+                                (redundant if old[0] == val else overridden) \
+                                    .append((sym.name, old, new))
+
+                            merged[sym] = new
+
+                            if sym.choice and val == "y":
+                                selections[sym.choice] = sym
+
+                except UnicodeDecodeError as e:
+                    _decoding_error(e, filename)
+
+            # Items without cached values stop the recursive invalidation in
+            # set_value() right away (see Symbol._rec_invalidate()), so after
+            # this, assigning the values below does not re-invalidate large
+            # parts of the tree once per assignment
+            self._invalidate_all()
+
+            for sym, (val, _, _) in merged.items():
+                sym.set_value(val)
+
+            for choice, sym in selections.items():
+                if choice.user_selection is not sym:
+                    choice.user_selection = sym
+                    choice._was_set = True
+                    choice._rec_invalidate()
+
+            if replace:
+                self._unset_unassigned()
+        finally:
+            self._warn_assign_no_prompt = True
+
+        return ({sym.name: assignment for sym, assignment in merged.items()},
+                overridden, redundant)
+
     def write_autoconf(self, filename=None, header=None):
         r"""
         Writes out symbol values as a C header file, matching the format used
@@ -1428,6 +1631,11 @@ class Kconfig(object):
         like the modification time and possibly triggering redundant work in
         build tools.
 
+        The header is generated incrementally: the #define lines from the
+        previous call are remembered, and only symbols whose values have
+        changed since then are re-rendered. The output is identical to what a
+        full regeneration would give.
+
         filename (default: None):
           Path to write header to.
 
@@ -1467,6 +1675,13 @@ class Kconfig(object):
         chunks = [header]  # "".join()ed later
         add = chunks.append
 
+        # #define lines from previous calls, indexed by symbol. A line only
+        # depends on the value and type of the symbol and on config_prefix,
+        # so only symbols whose value changed since the last call (or all of
+        # them, if config_prefix was changed) need to be re-rendered.
+        lines = self._autoconf_lines
+        prefix = self.config_prefix
+
         for sym in self.unique_defined_syms:
             # _write_to_conf is determined when the value is calculated. This
             # is a hidden function call due to property magic.
@@ -1478,25 +1693,36 @@ class Kconfig(object):
             if not sym._write_to_conf:
                 continue
 
+            cached = lines.get(sym)
+            if cached and cached[0] == val and cached[1] == prefix:
+                add(cached[2])
+                continue
+
             if sym.orig_type in _BOOL_TRISTATE:
                 if val == "y":
-                    add("#define {}{} 1\n"
-                        .format(self.config_prefix, sym.name))
+                    line = "#define {}{} 1\n" \
+                           .format(self.config_prefix, sym.name)
                 elif val == "m":
-                    add("#define {}{}_MODULE 1\n"
-                        .format(self.config_prefix, sym.name))
+                    line = "#define {}{}_MODULE 1\n" \
+                           .format(self.config_prefix, sym.name)
+                else:
+                    line = ""
 
             elif sym.orig_type is STRING:
-                add('#define {}{} "{}"\n'
-                    .format(self.config_prefix, sym.name, escape(val)))
+                line = '#define {}{} "{}"\n' \
+                       .format(self.config_prefix, sym.name, escape(val))
 
             else:  # sym.orig_type in _INT_HEX:
                 if sym.orig_type is HEX and \
                    not val.startswith(("0x", "0X")):
-                    val = "0x" + val
+                    line = "#define {}{} 0x{}\n" \
+                           .format(self.config_prefix, sym.name, val)
+                else:
+                    line = "#define {}{} {}\n" \
+                           .format(self.config_prefix, sym.name, val)
 
-                add("#define {}{} {}\n"
-                    .format(self.config_prefix, sym.name, val))
+            lines[sym] = (val, prefix, line)
+            add(line)
 
         return "".join(chunks)
 
@@ -4254,6 +4480,8 @@ class Symbol(object):
     """
     __slots__ = (
         "_cached_assignable",
+        "_cached_config_string",
+        "_cached_str_default",
         "_cached_str_val",
         "_cached_tri_val",
         "_cached_vis",
@@ -4541,26 +4769,14 @@ class Symbol(object):
         """
         See the class documentation.
         """
-        # _write_to_conf is determined when the value is calculated. This is a
-        # hidden function call due to property magic.
-        val = self.str_value
-        if not self._write_to_conf:
-            return ""
-
-        if self.orig_type in _BOOL_TRISTATE:
-            return "{}{}={}\n" \
-                   .format(self.kconfig.config_prefix, self.name, val) \
-                   if val != "n" else \
-                   "# {}{} is not set\n" \
-                   .format(self.kconfig.config_prefix, self.name)
-
-        if self.orig_type in _INT_HEX:
-            return "{}{}={}\n" \
-                   .format(self.kconfig.config_prefix, self.name, val)
-
-        # sym.orig_type is STRING
-        return '{}{}="{}"\n' \
-               .format(self.kconfig.config_prefix, self.name, escape(val))
+        # The rendered assignment is cached along with the value, which makes
+        # writing .config files mostly a matter of joining cached strings. It
+        # also depends on Kconfig.config_prefix, which is stored with it.
+        prefix = self.kconfig.config_prefix
+        cached = self._cached_config_string
+        if cached is None or cached[0] != prefix:
+            cached = self._cached_config_string = (prefix, self._config_string())
+        return cached[1]
 
     @property
     def name_and_loc(self):
@@ -4624,22 +4840,8 @@ class Symbol(object):
             return True
 
         # Check if the value is valid for our type
-        if not (self.orig_type is BOOL     and value in (2, 0)     or
-                self.orig_type is TRISTATE and value in TRI_TO_STR or
-                value.__class__ is str and
-                (self.orig_type is STRING                        or
-                 self.orig_type is INT and _is_base_n(value, 10) or
-                 self.orig_type is HEX and _is_base_n(value, 16)
-                                       and int(value, 16) >= 0)):
-
-            # Display tristate values as n, m, y in the warning
-            self.kconfig._warn(
-                "the value {} is invalid for {}, which has type {} -- "
-                "assignment ignored"
-                .format(TRI_TO_STR[value] if value in TRI_TO_STR else
-                            "'{}'".format(value),
-                        self.name_and_loc, TYPE_TO_STR[self.orig_type]))
-
+        if not self._is_valid_value(value):
+            self._warn_invalid_value(value)
             return False
 
         self.user_value = value
@@ -4812,7 +5014,8 @@ class Symbol(object):
         self.choice = \
         self.env_var = \
         self._cached_str_val = self._cached_tri_val = self._cached_vis = \
-        self._cached_assignable = None
+        self._cached_assignable = self._cached_str_default = \
+        self._cached_config_string = None
 
         # _write_to_conf is calculated along with the value. If True, the
         # Symbol gets a .config entry.
@@ -4824,6 +5027,51 @@ class Symbol(object):
         # See Kconfig._build_dep()
         self._dependents = set()
 
+    def _is_valid_value(self, value):
+        # Returns True if 'value' is valid as a user value for the symbol's
+        # type. This only looks at the form of the value. Bool/tristate values
+        # must already have been converted to 0/1/2.
+
+        return self.orig_type is BOOL     and value in (2, 0)     or \
+               self.orig_type is TRISTATE and value in TRI_TO_STR or \
+               value.__class__ is str and \
+               (self.orig_type is STRING                        or
+                self.orig_type is INT and _is_base_n(value, 10) or
+                self.orig_type is HEX and _is_base_n(value, 16)
+                                      and int(value, 16) >= 0)
+
+    def _warn_invalid_value(self, value):
+        # Warns about an assignment of a value rejected by _is_valid_value()
+
+        # Display tristate values as n, m, y in the warning
+        self.kconfig._warn(
+            "the value {} is invalid for {}, which has type {} -- "
+            "assignment ignored"
+            .format(TRI_TO_STR[value] if value in TRI_TO_STR else
+                        "'{}'".format(value),
+                    self.name_and_loc, TYPE_TO_STR[self.orig_type]))
+
+    def _config_string(self):
+        # Worker function for the 'config_string' attribute
+
+        # _write_to_conf is determined when the value is calculated. This is a
+        # hidden function call due to property magic.
+        val = self.str_value
+        if not self._write_to_conf:
+            return ""
+
+        prefix = self.kconfig.config_prefix + self.name
+
+        if self.orig_type in _BOOL_TRISTATE:
+            return prefix + "=" + val + "\n" if val != "n" else \
+                   "# " + prefix + " is not set\n"
+
+        if self.orig_type in _INT_HEX:
+            return prefix + "=" + val + "\n"
+
+        # sym.orig_type is STRING
+        return prefix + '="' + escape(val) + '"\n'
+
     def _assignable(self):
         # Worker function for the 'assignable' attribute
 
@@ -4874,7 +5122,8 @@ class Symbol(object):
         # Marks the symbol as needing to be recalculated
 
         self._cached_str_val = self._cached_tri_val = self._cached_vis = \
-        self._cached_assignable = None
+        self._cached_assignable = self._cached_str_default = \
+        self._cached_config_string = None
 
     def _rec_invalidate(self):
         # Invalidates the symbol and all items that (possibly) depend on it
@@ -4931,9 +5180,25 @@ class Symbol(object):
 
     def _str_default(self):
         # write_min_config() helper function. Returns the value the symbol
-        # would get from defaults if it didn't have a user value. Uses exactly
-        # the same algorithm as the C implementation (though a bit cleaned up),
-        # for compatibility.
+        # would get from defaults if it didn't have a user value. The value is
+        # cached and invalidated together with the other cached values, as it
+        # only depends on things that are in _dependents.
+
+        if self._cached_str_default is None:
+            # _cached_vis doubles as a flag for whether the symbol has cached
+            # values (see _rec_invalidate()). Make sure it's set, or the cached
+            # default might not get invalidated.
+            if self._cached_vis is None:
+                self._cached_vis = _visibility(self)
+
+            self._cached_str_default = self._calc_str_default()
+
+        return self._cached_str_default
+
+    def _calc_str_default(self):
+        # Worker function for _str_default(). Uses exactly the same algorithm
+        # as the C implementation (though a bit cleaned up), for
+        # compatibility.
 
         if self.orig_type in _BOOL_TRISTATE:
             val = 0
@@ -5162,6 +5427,7 @@ class Choice(object):
     """
     __slots__ = (
         "_cached_assignable",
+        "_cached_default_selection",
         "_cached_selection",
         "_cached_vis",
         "_dependents",
@@ -5407,7 +5673,8 @@ class Choice(object):
         self.user_value = self.user_selection = \
         self._cached_vis = self._cached_assignable = None
 
-        self._cached_selection = _NO_CACHED_SELECTION
+        self._cached_selection = self._cached_default_selection = \
+            _NO_CACHED_SELECTION
 
         # is_constant is checked by _depend_on(). Just set it to avoid having
         # to special-case choices.
@@ -5452,6 +5719,23 @@ class Choice(object):
         return self._selection_from_defaults()
 
     def _selection_from_defaults(self):
+        # Returns the symbol that would be selected in y mode if there was no
+        # user selection. Cached like Choice.selection, as write_min_config()
+        # calls this once per choice symbol.
+
+        if self._cached_default_selection is _NO_CACHED_SELECTION:
+            # See Symbol._str_default()
+            if self._cached_vis is None:
+                self._cached_vis = _visibility(self)
+
+            self._cached_default_selection = \
+                self._calc_selection_from_defaults()
+
+        return self._cached_default_selection
+
+    def _calc_selection_from_defaults(self):
+        # Worker function for _selection_from_defaults()
+
         # Check if we have a default
         for sym, cond in self.defaults:
             # The default symbol must be visible too
@@ -5468,7 +5752,8 @@ class Choice(object):
 
     def _invalidate(self):
         self._cached_vis = self._cached_assignable = None
-        self._cached_selection = _NO_CACHED_SELECTION
+        self._cached_selection = self._cached_default_selection = \
+            _NO_CACHED_SELECTION
 
     def _rec_invalidate(self):
         # See Symbol._rec_invalidate()
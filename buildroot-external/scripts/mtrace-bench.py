@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+
+import argparse
+from collections import namedtuple
+import importlib.util
+import json
+import os
+import resource
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+READER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "board",
+    "ovos",
+    "pc",
+    "rootfs-overlay",
+    "usr",
+    "local",
+    "bin",
+    "mtrace-reader.py",
+)
+
+# mtrace record header, the payload length
+HEADER = struct.Struct("I")
+
+# Reader modes, each benchmarked with FIFOs the reader polls, and with regular
+# files the feeders append to. Like the debugfs files, these can't be added to
+# epoll, so the reader falls back to reading and backing off while there's no
+# data, which is the path taken on the hardware.
+MODES = tuple(
+    f"{mode}-{source}"
+    for mode in ("stream", "capture", "asyncio")
+    for source in ("poll", "fallback")
+)
+
+# time for the reader to write out the records it read before it's stopped, for
+# sources without end-of-file, longer than its flush interval and backoff
+DRAIN_TIME = 0.5
+
+# Consumer of the asyncio mode, prints the payload of the records read with
+# MtraceReader, flushing each one so that the latency isn't hidden by buffering.
+# Dropped records are reported like the reader does, also when it's interrupted.
+ASYNCIO_CONSUMER = """
+import asyncio
+import importlib.util
+import sys
+
+spec = importlib.util.spec_from_file_location("mtrace_reader", sys.argv[1])
+mtrace_reader = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mtrace_reader)
+
+
+async def consume():
+    reader = mtrace_reader.MtraceReader(files=sys.argv[2:])
+    try:
+        async with reader:
+            async for record in reader:
+                sys.stdout.buffer.write(record.payload)
+                sys.stdout.buffer.flush()
+    finally:
+        if any(reader.drops.values()):
+            counts = ("core%d %d" % item for item in sorted(reader.drops.items()))
+            print("dropped records: " + ", ".join(counts), file=sys.stderr)
+
+
+try:
+    asyncio.run(consume())
+except KeyboardInterrupt:
+    pass
+"""
+
+Result = namedtuple(
+    "Result", "mode sent received dropped bytes seconds cpu latencies"
+)
+
+
+def load_reader(path: str):
+    """
+    Import mtrace-reader.py, whose name isn't a valid module name.
+    """
+    spec = importlib.util.spec_from_file_location("mtrace_reader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_payload(seq: int, size: int) -> bytes:
+    """
+    Return log line of size bytes with the sequence number and send time.
+    """
+    head = f"{seq} {time.monotonic_ns()} ".encode()
+    return head + b"x" * max(size - len(head) - 1, 0) + b"\n"
+
+
+def feed(fd: int, rate: float, size: int, duration: float, sent: dict) -> None:
+    """
+    Write records with size bytes of payload to the source fd, rate records per
+    second or as fast as the reader takes them if rate is 0, for duration
+    seconds, then close it. Store the number of records in sent[fd].
+    """
+    seq = 0
+    start = time.monotonic()
+    while (now := time.monotonic()) < start + duration:
+        if rate and (due := start + seq / rate) > now:
+            time.sleep(due - now)
+        payload = make_payload(seq, size)
+        # Each record is written at once like the debugfs file returns it.
+        os.write(fd, HEADER.pack(len(payload)) + payload)
+        seq += 1
+    sent[fd] = seq
+    os.close(fd)
+
+
+def wait_open(pid: int, paths: list, timeout: float = 10) -> None:
+    """
+    Wait until process pid has opened all paths.
+    """
+    paths = {os.path.abspath(path) for path in paths}
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        opened = set()
+        try:
+            fds = os.listdir(f"/proc/{pid}/fd")
+        except OSError:
+            break
+        for fd in fds:
+            try:
+                opened.add(os.readlink(f"/proc/{pid}/fd/{fd}"))
+            except OSError:
+                pass
+        if paths <= opened:
+            return
+        time.sleep(0.01)
+    raise RuntimeError("reader didn't open the sources")
+
+
+def wait_read(pid: int, paths: list, timeout: float = 60) -> None:
+    """
+    Wait until process pid has read the regular files at paths up to their end.
+    """
+    sizes = {os.path.abspath(path): os.path.getsize(path) for path in paths}
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pending = dict(sizes)
+        for fd in os.listdir(f"/proc/{pid}/fd"):
+            try:
+                path = os.readlink(f"/proc/{pid}/fd/{fd}")
+                with open(f"/proc/{pid}/fdinfo/{fd}") as f:
+                    pos = int(f.readline().split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            if pending.get(path) == pos:
+                del pending[path]
+        if not pending:
+            return
+        time.sleep(0.01)
+    raise RuntimeError("reader didn't read the sources")
+
+
+def consume(stream, stats: dict) -> None:
+    """
+    Read the log lines printed by the reader, counting them and their bytes,
+    and collecting their latency from the send time to the time they're read.
+    """
+    latencies = []
+    received = 0
+    size = 0
+    rest = b""
+    while data := stream.read1(65536):
+        now = time.monotonic_ns()
+        lines = (rest + data).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            if line.startswith(b"[core"):
+                line = line.split(b"] ", 1)[1]
+            latencies.append(now - int(line.split(b" ", 2)[1]))
+            received += 1
+            size += len(line) + 1
+    stats.update(received=received, bytes=size, latencies=latencies)
+
+
+def consume_errors(stream, stats: dict) -> None:
+    """
+    Pass on the error output of the reader, summing up the records it reports
+    as dropped because they couldn't be queued or written in time.
+    """
+    dropped = 0
+    for line in stream:
+        if line.startswith(b"dropped records: "):
+            for count in line[len(b"dropped records: ") :].split(b","):
+                dropped += int(count.split()[1])
+        else:
+            sys.stderr.buffer.write(line)
+            sys.stderr.buffer.flush()
+    stats["dropped"] = dropped
+
+
+def read_captures(reader, directory: str, stats: dict) -> None:
+    """
+    Count the records of the segments captured in directory and their bytes,
+    and collect their latency from the send time to the time they were read.
+    """
+    latencies = []
+    received = 0
+    size = 0
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        with reader.open_segment(path) as segment:
+            reader.read_segment_header(segment, path)
+            while record := reader.read_record(segment):
+                _, timestamp, payload = record
+                for line in payload.splitlines():
+                    latencies.append(timestamp - int(line.split(b" ", 2)[1]))
+                    received += 1
+                    size += len(line) + 1
+    stats.update(received=received, bytes=size, latencies=latencies)
+
+
+def run(mode: str, args: argparse.Namespace, workdir: str) -> Result:
+    """
+    Run the reader in mode on args.cores sources fed at args.rate, and return
+    the number of records sent, received and reported as dropped by the reader,
+    the received bytes, the time from the start of feeding to the reader's exit,
+    or until it read all of the regular files, its CPU time and the latencies.
+    """
+    reader_mode, source = mode.split("-")
+    sources = []
+    fds = []
+    for core in range(args.cores):
+        path = os.path.join(workdir, f"{mode}-core{core}")
+        if source == "poll":
+            os.mkfifo(path)
+            # Opened read-write before the reader starts, as the reader blocks
+            # opening a FIFO without writer, or sees end-of-file reading it if
+            # it opens it non-blocking.
+            fds.append(os.open(path, os.O_RDWR))
+        else:
+            fds.append(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND))
+        sources.append(path)
+
+    capture = os.path.join(workdir, f"{mode}-capture")
+    if reader_mode == "stream":
+        command = [sys.executable, args.reader, *sources]
+    elif reader_mode == "capture":
+        command = [sys.executable, args.reader, "--capture", capture, *sources]
+        if args.compress:
+            command[2:2] = ["--compress", args.compress]
+    else:
+        command = [sys.executable, "-c", ASYNCIO_CONSUMER, args.reader, *sources]
+
+    stats = {}
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    consumers = [
+        threading.Thread(target=consume, args=(process.stdout, stats)),
+        threading.Thread(target=consume_errors, args=(process.stderr, stats)),
+    ]
+    for consumer in consumers:
+        consumer.start()
+    try:
+        wait_open(process.pid, sources)
+        sent = {}
+        feeders = [
+            threading.Thread(
+                target=feed, args=(fd, args.rate, args.size, args.duration, sent)
+            )
+            for fd in fds
+        ]
+        start = time.monotonic()
+        for feeder in feeders:
+            feeder.start()
+        for feeder in feeders:
+            feeder.join()
+        if source == "poll":
+            process.wait(timeout=args.duration + 60)
+            seconds = time.monotonic() - start
+        else:
+            # regular files have no end-of-file the reader would stop at
+            wait_read(process.pid, sources)
+            seconds = time.monotonic() - start
+            time.sleep(DRAIN_TIME)
+            process.send_signal(signal.SIGINT)
+            process.wait(timeout=60)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        for consumer in consumers:
+            consumer.join()
+
+    if process.returncode:
+        raise RuntimeError(f"reader failed in {mode} mode")
+    child = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (child.ru_utime - usage.ru_utime) + (child.ru_stime - usage.ru_stime)
+    if reader_mode == "capture":
+        read_captures(load_reader(args.reader), capture, stats)
+
+    return Result(
+        mode,
+        sum(sent.values()),
+        stats["received"],
+        stats["dropped"],
+        stats["bytes"],
+        seconds,
+        cpu,
+        sorted(stats["latencies"]),
+    )
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Return the value at fraction of the sorted values, 0 if there are none.
+    """
+    if not values:
+        return 0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def result_record(result: Result) -> dict:
+    """
+    Return JSON serializable summary of result, latencies in milliseconds.
+    """
+    return {
+        "mode": result.mode,
+        "sent": result.sent,
+        "received": result.received,
+        "lost": result.sent - result.received,
+        "dropped": result.dropped,
+        "records_per_second": result.received / result.seconds,
+        "megabytes_per_second": result.bytes / result.seconds / 1e6,
+        "cpu_seconds": result.cpu,
+        "cpu_percent": 100 * result.cpu / result.seconds,
+        "latency_ms": {
+            "p50": percentile(result.latencies, 0.5) / 1e6,
+            "p99": percentile(result.latencies, 0.99) / 1e6,
+            "max": percentile(result.latencies, 1) / 1e6,
+        },
+    }
+
+
+def print_results(results: list) -> None:
+    print(
+        f"{'mode':<16} {'sent':>9} {'lost':>7} {'dropped':>7} {'records/s':>10} "
+        f"{'MB/s':>7} "
+        f"{'CPU s':>7} {'CPU %':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    for result in results:
+        record = result_record(result)
+        latency = record["latency_ms"]
+        print(
+            f"{record['mode']:<16} {record['sent']:>9} {record['lost']:>7} "
+            f"{record['dropped']:>7} "
+            f"{record['records_per_second']:>10.0f} "
+            f"{record['megabytes_per_second']:>7.2f} "
+            f"{record['cpu_seconds']:>7.2f} {record['cpu_percent']:>6.1f} "
+            f"{latency['p50']:>8.3f} {latency['p99']:>8.3f} {latency['max']:>8.3f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark mtrace-reader.py by feeding it length-prefixed "
+        "records from FIFOs (poll modes) or appended regular files (fallback "
+        "modes) standing in for the SOF mtrace debugfs files, and report "
+        "throughput, lost and dropped records, CPU usage and latency of each "
+        "mode. Latency is measured up to the reader's stdout for the stream and "
+        "asyncio modes, and up to the read for the capture modes."
+    )
+    parser.add_argument(
+        "--reader",
+        default=os.path.normpath(READER),
+        help="Path to mtrace-reader.py (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--mode",
+        action="append",
+        choices=MODES,
+        help="Reader mode to benchmark, can be given several times (default: all)",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=1,
+        help="Number of sources fed in parallel (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1000,
+        help="Records per second and core, 0 to feed as fast as the reader "
+        "takes them (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=128,
+        help="Payload bytes per record (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5,
+        help="Seconds to feed the reader in each mode (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=("xz", "zstd"),
+        help="Compress the segments in capture mode",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("text", "json"),
+        default="text",
+        help="Output format",
+    )
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="mtrace-bench-") as workdir:
+        for mode in args.mode or MODES:
+            results.append(run(mode, args, workdir))
+
+    if args.format == "json":
+        json.dump([result_record(result) for result in results], sys.stdout, indent=2)
+        print()
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()